@@ -0,0 +1,156 @@
+from __future__ import print_function
+
+import atomic_file
+import hashlib
+import instrument
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from absl import app
+
+# Columnar cache of the Caltech ACN session export.
+#
+# The line-delimited Extended JSON is converted once into a directory of .npy
+# files next to it, which are then memory-mapped. Timestamps are int64 epoch
+# seconds, energy is float64, and ids and space numbers are dictionary-encoded
+# as int32 codes into arrays of distinct values. Rows keep the order of the
+# file. The first line of the file is skipped, as LoadData always did.
+#
+# start_order lists the rows by start time (ties in file order) and
+# sorted_start_sec holds their start times, so that StartRange() can bisect
+# for a window of sessions without reading the rest.
+#
+# The cache records the size, mtime and SHA-256 of the file it was built
+# from. A changed mtime triggers a rehash, and only a changed hash rebuilds.
+
+FORMAT_VERSION = 2
+
+COLUMNS = ['id_code', 'start_sec', 'end_sec', 'done_charging_sec', 'energy_kwh', 'location_code', 'id_values', 'location_values',
+           'start_order', 'sorted_start_sec']
+
+
+def CacheDir(json_path):
+  return json_path + '.columns'
+
+
+def _FileHash(path):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _Source(json_path, digest=None):
+  stat = os.stat(json_path)
+  return {'version': FORMAT_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest or _FileHash(json_path)}
+
+
+def _WriteMeta(cache_dir, source):
+  atomic_file.AtomicWrite(os.path.join(cache_dir, 'meta.json'), lambda f : json.dump(source, f))
+
+
+def _EpochSeconds(field):
+  return int(field['$date']['$numberLong']) // 1000
+
+
+# Parses json_path and writes its columns to CacheDir(json_path).
+def ConvertToColumns(json_path):
+  ids = []
+  start_sec = []
+  end_sec = []
+  done_charging_sec = []
+  energy_kwh = []
+  locations = []
+  with open(json_path) as data_file:
+    next(data_file)
+    for line in data_file:
+      session = json.loads(line)
+      ids.append(session['_id']['$oid'])
+      start_sec.append(_EpochSeconds(session['start']))
+      end_sec.append(_EpochSeconds(session['end']))
+      done_charging_sec.append(_EpochSeconds(session['done_charging']))
+      energy_kwh.append(float(session['kWh_delivered']['$numberDouble']))
+      locations.append(session['space_number'])
+  id_values, id_code = np.unique(np.array(ids, dtype=np.bytes_), return_inverse=True)
+  location_values, location_code = np.unique(np.array(locations, dtype=np.bytes_), return_inverse=True)
+  columns = {
+      'id_code': id_code.astype(np.int32),
+      'start_sec': np.array(start_sec, dtype=np.int64),
+      'end_sec': np.array(end_sec, dtype=np.int64),
+      'done_charging_sec': np.array(done_charging_sec, dtype=np.int64),
+      'energy_kwh': np.array(energy_kwh, dtype=np.float64),
+      'location_code': location_code.astype(np.int32),
+      'id_values': id_values,
+      'location_values': location_values,
+  }
+  columns['start_order'] = np.argsort(columns['start_sec'], kind='mergesort')
+  columns['sorted_start_sec'] = columns['start_sec'][columns['start_order']]
+  # Build next to the final directory and swap it in, so that readers never
+  # see a half-written cache.
+  cache_dir = CacheDir(json_path)
+  parent = os.path.dirname(os.path.abspath(cache_dir))
+  build_dir = tempfile.mkdtemp(dir=parent, prefix='.columns.')
+  os.chmod(build_dir, 0o755)
+  for name in COLUMNS:
+    np.save(os.path.join(build_dir, name + '.npy'), columns[name])
+  _WriteMeta(build_dir, _Source(json_path))
+  if os.path.isdir(cache_dir):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+  try:
+    os.rename(build_dir, cache_dir)
+  except OSError:
+    # Another process swapped its cache in first.
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+
+# Returns True if CacheDir(json_path) was built from the current json_path.
+def IsFresh(json_path):
+  try:
+    with open(os.path.join(CacheDir(json_path), 'meta.json')) as f:
+      cached = json.load(f)
+  except (IOError, OSError, ValueError):
+    return False
+  stat = os.stat(json_path)
+  if cached.get('version') != FORMAT_VERSION or cached['size'] != stat.st_size:
+    return False
+  if cached['mtime'] == stat.st_mtime:
+    return True
+  digest = _FileHash(json_path)
+  if digest != cached['sha256']:
+    return False
+  _WriteMeta(CacheDir(json_path), _Source(json_path, digest))
+  return True
+
+
+# Returns a dict of the memory-mapped columns of json_path, converting it
+# first if the cache is missing or stale.
+def LoadColumns(json_path):
+  with instrument.Span('load_columns'):
+    if not IsFresh(json_path):
+      ConvertToColumns(json_path)
+    cache_dir = CacheDir(json_path)
+    return dict((name, np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')) for name in COLUMNS)
+
+
+# Returns the rows of the sessions starting within [first_sec, last_sec], in
+# order of start time.
+def StartRange(columns, first_sec, last_sec):
+  begin = np.searchsorted(columns['sorted_start_sec'], first_sec, 'left')
+  end = np.searchsorted(columns['sorted_start_sec'], last_sec, 'right')
+  return columns['start_order'][begin:end]
+
+
+def main(argv):
+  for json_path in argv[1:]:
+    ConvertToColumns(json_path)
+    columns = LoadColumns(json_path)
+    print(json_path, '->', CacheDir(json_path), 'sessions:', len(columns['start_sec']), 'locations:', len(columns['location_values']))
+
+
+if __name__ == '__main__':
+  app.run(main)
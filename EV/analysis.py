@@ -1,82 +1,137 @@
 from __future__ import print_function
 
-import datetime
-import math
-import matplotlib.pyplot as plt
+import collections
+import glob
+import os
+import re
+
+import matplotlib
 import numpy as np
+import results
 
 from absl import app
 from absl import flags
 
-flags.DEFINE_string('dir', '', 'directory of the data')
+flags.DEFINE_list('results', [], 'result tables written by sweep.py or ev.py --results, CSV or .npz')
+flags.DEFINE_list('logs', [], 'directories of scale=<scale> files of printed summaries, as in no_reservation')
+flags.DEFINE_string('plot', '', 'file to save the plots to instead of showing them')
 
 FLAGS = flags.FLAGS
 
-def ReadData(file):
-  data = {}
-  with open(FLAGS.dir + file) as f:
-    content = f.readlines()
-    for i in range(7):
-      key = 1.0 + 0.05 * i
-      value = []
-      for item in content[i].split():
-        value.append(float(item))
-      data[key] = value
-  return data
+SETTING_COLUMNS = ['scale', 'prob', 'reserve_lead_hours', 'schedule_slot_min']
+OPTIMAL_NAME = 'Offline optimal scheduler'
 
-def main(argv):
-  eps_peak = ReadData('eps_peak')
-  greedy_peak = ReadData('greedy_peak')
-  optimal_peak = ReadData('optimal_peak')
-  eps_finish_ratio = ReadData('eps_finish_ratio')
-  greedy_finish_ratio = ReadData('greedy_finish_ratio')
-  num_days = len(eps_peak[1.0])
-  plt.figure()
-  keys = []
-  greedy_crs = []
-  eps_crs = []
-  for key in optimal_peak:
-    keys.append(key)
-    greedy_cr = 0.0
-    eps_cr = 0.0
-    for i in range(num_days):
-      ratio = greedy_peak[key][i] / optimal_peak[key][i]
-      if ratio > greedy_cr:
-        greedy_cr_idx = i
-        greedy_cr = ratio
-      # greedy_cr += greedy_peak[key][i] / optimal_peak[key][i]
-      ratio = eps_peak[key][i] / optimal_peak[key][i]
-      if ratio > eps_cr:
-        eps_cr_idx = i
-        eps_cr = ratio
-      # eps_cr += eps_peak[key][i] / optimal_peak[key][i]
-    print('worst case for greedy: ', greedy_cr_idx)
-    print('worst case for eps: ', eps_cr_idx)
-    greedy_crs.append(greedy_cr)
-    eps_crs.append(eps_cr)
-  plt.scatter(keys, greedy_crs, label='CR of greedy algorithm')
-  plt.scatter(keys, eps_crs, label='CR of eps algorithm')
-  plt.legend()
+_SUMMARY_LINE = re.compile(r"^(.*) 's finish ratio:\s+(\S+)\s+peak:\s+(\S+)$")
+_RESERVE_DIR = re.compile(r'^reserve_([0-9.]+)_([0-9.]+)h$')
+
+# Returns the rows of the scale=<scale> files in directory, which hold the
+# summaries ev.py prints, the offline optimal one last for every day. The
+# reserve probability and lead are taken from a directory named
+# no_reservation or reserve_<prob>_<lead hours>h; settings the files do not
+# record are nan.
+def ReadLogs(directory):
+  (prob, reserve_lead_hours) = (np.nan, np.nan)
+  name = os.path.basename(os.path.normpath(directory))
+  if name == 'no_reservation':
+    prob = 0.0
+  elif _RESERVE_DIR.match(name):
+    (prob, reserve_lead_hours) = [float(value) for value in _RESERVE_DIR.match(name).groups()]
+  rows = []
+  for path in sorted(glob.glob(os.path.join(directory, 'scale=*'))):
+    scale = float(os.path.basename(path)[len('scale='):])
+    day = []
+    day_index = 0
+    with open(path) as f:
+      for line in f:
+        match = _SUMMARY_LINE.match(line.strip())
+        if not match:
+          continue
+        day.append((match.group(1), float(match.group(2)), float(match.group(3))))
+        if match.group(1) == OPTIMAL_NAME:
+          for (name, unfinished_ratio, peak) in day:
+            rows.append((str(day_index), scale, prob, reserve_lead_hours, np.nan, name, unfinished_ratio, peak, np.nan, np.nan, day[-1][2]))
+          day = []
+          day_index += 1
+  return rows
+
+# Returns the table of rows as results.Load would.
+def RowTable(rows):
+  columns = list(zip(*rows))
+  return collections.OrderedDict((name, np.array(values, dtype=np.str_ if name in results.STRING_COLUMNS else np.float64))
+                                 for name, values in zip(results.COLUMNS, columns))
 
-  plt.figure()
-  keys = []
-  greedy_ratios = []
-  eps_ratios = []
-  for key in optimal_peak:
-    keys.append(key)
-    greedy_ratio = 0.0
-    eps_ratio = 0.0
-    for i in range(num_days):
-      greedy_ratio += greedy_finish_ratio[key][i]
-      eps_ratio += eps_finish_ratio[key][i]
-    greedy_ratio /= num_days
-    eps_ratio /= num_days
-    greedy_ratios.append(greedy_ratio)
-    eps_ratios.append(eps_ratio)
-  plt.scatter(keys, greedy_ratios, label='Unfinish rate of greedy algorithm')
-  plt.scatter(keys, eps_ratios, label='Unfinish rate of eps algorithm')
-  plt.legend()
-  plt.show()
+# Returns, for the rows of table, the index of their group of equal values in
+# columns and the first row of every group, groups sorted by those values.
+def GroupBy(table, columns):
+  codes = []
+  for name in columns:
+    values = table[name]
+    if values.dtype.kind == 'f':
+      # nan != nan, so settings that are not recorded would not group.
+      values = np.where(np.isnan(values), np.inf, values)
+    codes.append(np.unique(values, return_inverse=True)[1].reshape(-1))
+  (keys, first, group) = np.unique(np.stack(codes, axis=1), axis=0, return_index=True, return_inverse=True)
+  return group.reshape(-1), first
+
+# Returns per group of the online schedulers' rows in table with equal
+# settings and scheduler an OrderedDict of its settings and scheduler, its
+# number of days, its worst and mean competitive ratio (peak over the
+# optimal peak of the day), the day of the worst and its mean unfinished
+# ratio.
+def CompetitiveRatios(table):
+  # multisite.py names the oracle of a site OPTIMAL_NAME@site.
+  online = ~np.char.startswith(table['scheduler'], OPTIMAL_NAME) & (table['optimal_peak'] > 0)
+  table = collections.OrderedDict((name, values[online]) for name, values in table.items())
+  (group, first) = GroupBy(table, SETTING_COLUMNS + ['scheduler'])
+  ratio = table['peak'] / table['optimal_peak']
+  days = np.bincount(group)
+  # The last row of every group once sorted by group and ratio is its worst.
+  order = np.lexsort((ratio, group))
+  worst = order[np.cumsum(days) - 1]
+  stats = collections.OrderedDict((name, table[name][first]) for name in SETTING_COLUMNS + ['scheduler'])
+  stats['days'] = days
+  stats['worst_cr'] = ratio[worst]
+  stats['worst_day'] = table['day'][worst]
+  stats['mean_cr'] = np.bincount(group, weights=ratio) / days
+  stats['mean_unfinished_ratio'] = np.bincount(group, weights=table['unfinished_ratio']) / days
+  return stats
+
+def Plot(stats):
+  if FLAGS.plot:
+    matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+  (series, first) = GroupBy(stats, ['prob', 'reserve_lead_hours', 'schedule_slot_min', 'scheduler'])
+  (figure, axes) = plt.subplots(1, 3, figsize=(18, 5))
+  for i, row in enumerate(first.tolist()):
+    label = '%s prob %g lead %gh slot %gmin' % (stats['scheduler'][row], stats['prob'][row], stats['reserve_lead_hours'][row],
+                                               stats['schedule_slot_min'][row])
+    for ax, name in zip(axes, ['worst_cr', 'mean_cr', 'mean_unfinished_ratio']):
+      ax.scatter(stats['scale'][series == i], stats[name][series == i], label=label)
+  for ax, title in zip(axes, ['Worst-case competitive ratio', 'Mean competitive ratio', 'Mean unfinished ratio']):
+    ax.set_title(title)
+    ax.set_xlabel('scale')
+  axes[0].legend(fontsize='small')
+  if FLAGS.plot:
+    figure.savefig(FLAGS.plot)
+  else:
+    plt.show()
+
+# Prints and plots the worst-case and mean competitive ratio and the mean
+# unfinished ratio of every online scheduler and setting found in --results
+# and --logs.
+def main(argv):
+  rows = []
+  for directory in FLAGS.logs:
+    rows.extend(ReadLogs(directory))
+  tables = [results.Load(path) for path in FLAGS.results] + ([RowTable(rows)] if rows else [])
+  if not tables:
+    raise app.UsageError('no --results or --logs given')
+  table = collections.OrderedDict((name, np.concatenate([t[name] for t in tables])) for name in results.COLUMNS)
+  stats = CompetitiveRatios(table)
+  print(' '.join(stats.keys()))
+  for i in range(len(stats['days'])):
+    print(' '.join(results.Format(stats[name][i].item()) for name in stats))
+  Plot(stats)
 
 if __name__ == '__main__':
   app.run(main)
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+# Writes files so that readers, other processes included, see either the
+# whole file or none of it.
+
+
+# Writes path through write_fn(f), with f opened in mode on a temporary file
+# in the same directory that is then renamed to path. Creates the directory
+# if needed. A crash leaves path as it was, and of concurrent writers of one
+# path the last rename wins. The file is made readable by all, as open()
+# would make it under the usual umask.
+def AtomicWrite(path, write_fn, mode='w'):
+  directory = os.path.dirname(os.path.abspath(path))
+  if not os.path.isdir(directory):
+    try:
+      os.makedirs(directory)
+    except OSError:
+      # Another process created it first.
+      pass
+  (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+  try:
+    with os.fdopen(fd, mode) as f:
+      write_fn(f)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+  except BaseException:
+    os.remove(tmp_path)
+    raise
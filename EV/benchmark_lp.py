@@ -0,0 +1,53 @@
+from __future__ import print_function
+
+import datetime
+import time
+
+import ev
+import peak_lp
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('lp_solvers', ['glop', 'highs', 'pdlp'], 'LP backends to benchmark')
+flags.DEFINE_integer('days', 0, 'number of days to benchmark, 0 for all')
+
+# Builds and solves the offline-optimal peak LP of every Caltech ACN day with
+# each backend and reports the time spent in each phase. --lp_slot_sec and
+# --event_grid pick the time grid as in ev.py.
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  total_build_sec = 0.0
+  total_solve_sec = {solver: 0.0 for solver in FLAGS.lp_solvers}
+  num_days = 0
+  for data in ev.StreamDataBatch(time_period[0], time_period[1], datetime.timedelta(hours=24)):
+    if FLAGS.days and num_days >= FLAGS.days:
+      break
+    if len(data) == 0:
+      continue
+    ev_jobs = [schedule.EvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh,
+                              record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time))
+               for record in data]
+    start = time.time()
+    horizon_start, start_sec, end_sec, demand_kwh, max_charging_rate = peak_lp.JobArrays(ev_jobs)
+    boundaries = peak_lp.EventGrid(start_sec, end_sec) if FLAGS.event_grid else None
+    lp = peak_lp.BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate, FLAGS.lp_slot_sec, boundaries)
+    build_sec = time.time() - start
+    total_build_sec += build_sec
+    line = [horizon_start.strftime('%Y-%m-%d'), 'jobs: %d' % len(ev_jobs), 'vars: %d' % lp.num_vars, 'build: %.4f' % build_sec]
+    for solver in FLAGS.lp_solvers:
+      start = time.time()
+      peak, total_rate = peak_lp.SolvePeakLp(lp, solver)
+      solve_sec = time.time() - start
+      total_solve_sec[solver] += solve_sec
+      line.append('%s: %.4f (peak %.4f)' % (solver, solve_sec, peak))
+    print(' '.join(line))
+    num_days += 1
+  print('days: %d build: %.3f' % (num_days, total_build_sec), ' '.join('%s: %.3f' % (solver, total_solve_sec[solver]) for solver in FLAGS.lp_solvers))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,66 @@
+from __future__ import print_function
+
+import collections
+import datetime
+import time
+
+import ev
+import numpy as np
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('period_days', 7, 'days per line of the report')
+flags.DEFINE_integer('unbounded_days', 7, 'days to also run the eps scheduler without a rolling horizon for, 0 for none')
+
+# Replays the whole Caltech ACN period without cutting it into days, and
+# reports the latency of the Schedule calls of GreedyScheduler and of
+# EpsScheduler with --rolling_horizon per --period_days. With a rolling
+# horizon the eps model only holds the jobs present or announced, so the
+# latency should stay flat; for comparison the eps scheduler without it is
+# run over the first --unbounded_days, where every tick solves over all jobs
+# so far. --lp_solver and --lp_slot_sec are as for ev.py.
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  data = ev.LoadData(time_period[0], time_period[1])
+  data.sort(key=lambda record : record.reserve_time)
+  schedulers = collections.OrderedDict([
+      ('greedy', schedule.GreedyScheduler(FLAGS.scale, FLAGS.lp_solver, slot_length_sec=FLAGS.lp_slot_sec)),
+      ('eps rolling', schedule.EpsScheduler(FLAGS.scale, FLAGS.lp_solver, slot_length_sec=FLAGS.lp_slot_sec, rolling_horizon=True))])
+  if FLAGS.unbounded_days:
+    schedulers['eps unbounded'] = schedule.EpsScheduler(FLAGS.scale, FLAGS.lp_solver, slot_length_sec=FLAGS.lp_slot_sec)
+  unbounded_end = time_period[0] + datetime.timedelta(days=FLAGS.unbounded_days)
+  schedule_slot = datetime.timedelta(minutes=FLAGS.schedule_slot_min)
+  period = datetime.timedelta(days=FLAGS.period_days)
+  # Per period and scheduler, the seconds of every Schedule call.
+  latency = collections.defaultdict(lambda: collections.defaultdict(list))
+  model_vars = collections.defaultdict(list)
+  last_schedule_time = datetime.datetime.min
+  for record in data:
+    max_charging_rate = record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time)
+    if 'eps unbounded' in schedulers and record.reserve_time > unbounded_end:
+      del schedulers['eps unbounded']
+    for scheduler in schedulers.values():
+      scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+    if record.reserve_time > last_schedule_time + schedule_slot:
+      period_index = max((record.reserve_time - time_period[0]).days // FLAGS.period_days, 0)
+      for name, scheduler in schedulers.items():
+        start = time.time()
+        scheduler.Schedule(record.reserve_time)
+        latency[period_index][name].append(time.time() - start)
+      model_vars[period_index].append(schedulers['eps rolling'].rolling_peak_lp.num_vars)
+      last_schedule_time = record.reserve_time
+  for period_index in sorted(latency):
+    line = [(time_period[0] + period_index * period).strftime('%Y-%m-%d'), 'ticks: %d' % len(model_vars[period_index]),
+            'eps vars: %d' % max(model_vars[period_index])]
+    for name in latency[period_index]:
+      seconds = np.array(latency[period_index][name]) * 1000.0
+      line.append('%s p50/p95/max ms: %.2f/%.2f/%.2f' % (name, np.percentile(seconds, 50), np.percentile(seconds, 95), seconds.max()))
+    print(' '.join(line))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,149 @@
+from __future__ import print_function
+
+import atomic_file
+import concurrent.futures
+import datetime
+import json
+import platform
+import resource
+import time
+
+import ev
+import numpy as np
+import schedule
+import workload
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+SCHEDULERS = ['greedy', 'eps', 'eps_rolling', 'max_rate', 'fix_rate', 'oracle']
+
+flags.DEFINE_list('bench_schedulers', ['greedy', 'eps_rolling', 'max_rate', 'fix_rate', 'oracle'],
+                  'schedulers to benchmark, of ' + ', '.join(SCHEDULERS))
+flags.DEFINE_list('concurrency', ['1', '10', '100'], 'multiples of --arrivals_per_hour to benchmark at')
+flags.DEFINE_float('arrivals_per_hour', workload.DEFAULT_WORKLOAD.arrivals_per_hour, 'session arrivals per hour at concurrency 1')
+flags.DEFINE_float('mean_dwell_hours', workload.DEFAULT_WORKLOAD.mean_dwell_hours, 'mean time a session stays')
+flags.DEFINE_float('mean_energy_kwh', workload.DEFAULT_WORKLOAD.mean_energy_kwh, 'mean energy a session wants')
+flags.DEFINE_float('max_rate_kw', workload.DEFAULT_WORKLOAD.max_rate_kw, 'highest rate cap of a session')
+flags.DEFINE_float('hours', 24.0, 'length of the generated workload')
+flags.DEFINE_integer('seed', 0, 'seed of the generated workload')
+flags.DEFINE_float('cell_budget_sec', 300.0, 'stop a scheduler at a concurrency once it has run this long, 0 for no limit')
+flags.DEFINE_string('output', 'benchmark.json', 'file to write the results to as JSON')
+
+
+def _MakeScheduler(name, config):
+  if name == 'greedy':
+    return schedule.GreedyScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid)
+  if name in ['eps', 'eps_rolling']:
+    return schedule.EpsScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid,
+                                 rolling_horizon=(name == 'eps_rolling'))
+  if name == 'max_rate':
+    return schedule.MaxRateScheduler(False)
+  if name == 'fix_rate':
+    return schedule.FixRateScheduler(False)
+  return schedule.OracleScheduler(config.lp_solver, config.lp_slot_sec, config.event_grid)
+
+# Returns the highest number of sessions present at once.
+def _MaxPresent(records):
+  starts = np.array([ev.ToEpochSeconds(record.start_time) for record in records])
+  ends = np.array([ev.ToEpochSeconds(record.end_time) for record in records])
+  order = np.argsort(np.concatenate([ends, starts]), kind='mergesort')
+  return int(np.cumsum(np.concatenate([-np.ones(len(ends)), np.ones(len(starts))])[order]).max())
+
+# Generates the workload of a cell and replays it through one scheduler as
+# ev.RunDay would, timing every Schedule() call. Run in a process of its own,
+# so that the growth of the peak resident set over the replay is the
+# scheduler's.
+def _RunCell(cell):
+  (name, concurrency, config, workload_config, hours, seed, budget_sec) = cell
+  start_time = datetime.datetime(2018, 4, 16, 0, 0, 0)
+  records = workload.GenerateRecords(workload_config, start_time, start_time + datetime.timedelta(hours=hours), seed)
+  records.sort(key=lambda record : record.reserve_time)
+  base_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  scheduler = _MakeScheduler(name, config)
+  continuous = isinstance(scheduler, schedule.ContinuousScheduler)
+  latencies = []
+  schedule_slot = datetime.timedelta(minutes=config.schedule_slot_min)
+  last_schedule_time = datetime.datetime.min
+  num_jobs = 0
+  truncated = False
+  run_start = time.time()
+  for record in records:
+    if budget_sec and time.time() - run_start > budget_sec:
+      truncated = True
+      break
+    max_charging_rate = record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time)
+    scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+    num_jobs += 1
+    if continuous or (name != 'oracle' and record.reserve_time > last_schedule_time + schedule_slot):
+      start = time.time()
+      scheduler.Schedule(record.reserve_time)
+      latencies.append(time.time() - start)
+      last_schedule_time = record.reserve_time
+  if name == 'oracle' and not truncated:
+    start = time.time()
+    scheduler.Schedule(datetime.datetime.max)
+    latencies.append(time.time() - start)
+  total_sec = time.time() - run_start
+  latency_ms = np.array(latencies) * 1000.0 if latencies else np.zeros(1)
+  return {
+      'scheduler': name,
+      'concurrency': concurrency,
+      'sessions': len(records),
+      'max_present': _MaxPresent(records),
+      'jobs': num_jobs,
+      'truncated': truncated,
+      'schedule_calls': len(latencies),
+      'latency_ms': {'p50': float(np.percentile(latency_ms, 50)), 'p95': float(np.percentile(latency_ms, 95)),
+                     'p99': float(np.percentile(latency_ms, 99)), 'max': float(latency_ms.max())},
+      'total_sec': total_sec,
+      'jobs_per_sec': num_jobs / total_sec if total_sec > 0 else 0.0,
+      'peak_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss_kb,
+      'peak': float(scheduler.schedule_history.peak),
+  }
+
+# Replays seeded synthetic workloads (see workload.py) at every --concurrency
+# through every --bench_schedulers and writes the Schedule() latency
+# percentiles, the throughput in jobs per second of the whole replay and the
+# growth of the peak resident set to --output, one record per scheduler and
+# concurrency. --prob and --reserve_lead_hours set the reservations,
+# --scale, --lp_solver, --incremental_lp, --lp_slot_sec, --event_grid and
+# --schedule_slot_min the schedulers, as for ev.py.
+def main(argv):
+  for name in FLAGS.bench_schedulers:
+    if name not in SCHEDULERS:
+      raise app.UsageError('unknown scheduler %s' % name)
+  config = ev.SimConfigFromFlags()
+  base = workload.DEFAULT_WORKLOAD._replace(mean_dwell_hours=FLAGS.mean_dwell_hours, mean_energy_kwh=FLAGS.mean_energy_kwh,
+                                            max_rate_kw=FLAGS.max_rate_kw, reserve_prob=FLAGS.prob,
+                                            reserve_lead_hours=FLAGS.reserve_lead_hours)
+  cells = []
+  for concurrency in [float(concurrency) for concurrency in FLAGS.concurrency]:
+    for name in FLAGS.bench_schedulers:
+      cells.append((name, concurrency, config, base._replace(arrivals_per_hour=FLAGS.arrivals_per_hour * concurrency), FLAGS.hours,
+                    FLAGS.seed, FLAGS.cell_budget_sec))
+  records = []
+  for cell in cells:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+      record = executor.submit(_RunCell, cell).result()
+    print('%s x%g: sessions %d max present %d calls %d p50/p95/max ms %.2f/%.2f/%.2f jobs/s %.1f rss +%d KB%s' % (
+        record['scheduler'], record['concurrency'], record['sessions'], record['max_present'], record['schedule_calls'],
+        record['latency_ms']['p50'], record['latency_ms']['p95'], record['latency_ms']['max'], record['jobs_per_sec'],
+        record['peak_rss_growth_kb'], ' (truncated)' if record['truncated'] else ''))
+    records.append(record)
+  report = {
+      'host': platform.node(),
+      'python': platform.python_version(),
+      'config': dict(config._asdict()),
+      'workload': dict(base._asdict()),
+      'hours': FLAGS.hours,
+      'seed': FLAGS.seed,
+      'results': records,
+  }
+  atomic_file.AtomicWrite(FLAGS.output, lambda f : json.dump(report, f, indent=1, sort_keys=True))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,59 @@
+from __future__ import print_function
+
+import datetime
+import sys
+import time
+
+import ev
+import numpy as np
+import peak_flow
+import peak_lp
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_float('tolerance', 1e-6, 'relative tolerance on the peak')
+
+# Cross-checks peak_flow.SolvePeakFlow against GLOP on the same event grid for
+# every Caltech ACN day. Also reports the peak of the 900-second slot LP, which
+# can only be higher.
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  num_failures = 0
+  flow_sec = 0.0
+  glop_sec = 0.0
+  for data in ev.StreamDataBatch(time_period[0], time_period[1], datetime.timedelta(hours=24)):
+    if len(data) == 0:
+      continue
+    ev_jobs = [schedule.EvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh,
+                              record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time))
+               for record in data]
+    horizon_start, start_sec, end_sec, demand_kwh, max_charging_rate = peak_lp.JobArrays(ev_jobs)
+    start = time.time()
+    peak, boundaries, cell_rate = peak_flow.SolvePeakFlow(start_sec, end_sec, demand_kwh, max_charging_rate)
+    flow_sec += time.time() - start
+    start = time.time()
+    lp = peak_lp.BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate, boundaries=boundaries)
+    glop_peak, glop_rate = peak_lp.SolvePeakLp(lp, 'glop')
+    glop_sec += time.time() - start
+    slot_peak, slot_rate = peak_lp.SolvePeakLp(peak_lp.BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate), 'glop')
+
+    delivered = np.dot(cell_rate, np.diff(boundaries)) / 3600.0
+    expected = np.minimum(demand_kwh, (end_sec - start_sec) * max_charging_rate / 3600.0).sum()
+    ok = (abs(peak - glop_peak) <= FLAGS.tolerance * max(glop_peak, 1.0) and
+          cell_rate.max() <= peak * (1 + FLAGS.tolerance) and
+          abs(delivered - expected) <= FLAGS.tolerance * max(expected, 1.0))
+    if not ok:
+      num_failures += 1
+    print(horizon_start.strftime('%Y-%m-%d'), 'OK' if ok else 'MISMATCH', 'flow: %.6f' % peak,
+          'glop: %.6f' % glop_peak, 'slot glop: %.6f' % slot_peak)
+  print('flow: %.3f sec glop: %.3f sec failures: %d' % (flow_sec, glop_sec, num_failures))
+  if num_failures:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
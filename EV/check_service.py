@@ -0,0 +1,87 @@
+from __future__ import print_function
+
+import sys
+
+import ev
+import service
+
+from absl import app
+
+# Replays sequences of requests through SchedulingService._Tick, one list of
+# requests per tick, and checks the setpoints it returns. Covers the event
+# orders the offline replay of ev.py never produces. Also checks that _Invalid
+# rejects malformed requests and that a tick that fails on a request leaves
+# the scheduler as it was. Python 3 only, as service.py.
+
+_T0 = 1523930000.0
+
+
+def _Plugin(session_id, time, end, energy_kwh=5.0):
+  return {'event': 'plugin', 'id': session_id, 'time': time, 'start': time, 'end': end, 'energy_kwh': energy_kwh, 'max_rate_kw': 6.6}
+
+
+# (name, ticks, check of the (time, total rate, seconds) of every tick).
+CASES = [
+    # The unplug leaves no jobs, so the rate drops to 0; the next tick then
+    # has to simulate charging at that rate before scheduling the two new
+    # sessions.
+    ('unplug then two plug-ins', [[_Plugin('a', _T0, _T0 + 3600)],
+                                  [{'event': 'unplug', 'id': 'a', 'time': _T0 + 7200}],
+                                  [_Plugin('b', _T0 + 8000, _T0 + 20000), _Plugin('c', _T0 + 8100, _T0 + 20000)],
+                                  [{'event': 'tick', 'time': _T0 + 9000}]],
+     lambda results : results[1][1] == 0.0 and results[2][1] > 0.0 and results[3][1] > 0.0),
+]
+
+# Requests _Invalid has to reject, so that they never fail a tick.
+INVALID_REQUESTS = [
+    dict(_Plugin('a', _T0, _T0 + 3600), id=['a']),
+    dict(_Plugin('a', _T0, _T0 + 3600), id={'a': 1}),
+    {'event': 'unplug', 'id': 7, 'time': _T0},
+    {'event': 'tick', 'time': 1e20},
+    {'event': 'tick', 'time': float('nan')},
+    dict(_Plugin('a', _T0, _T0 + 3600), end=-1.0),
+    dict(_Plugin('a', _T0, _T0 + 3600), energy_kwh=float('inf')),
+]
+
+
+def _NewService():
+  return service.SchedulingService(service._MakeScheduler(ev.SimConfigFromFlags()), 0.0, 1.0)
+
+# Returns whether a tick of a valid plug-in and one whose time datetime
+# cannot hold, which _Invalid would have rejected, fails without adding the
+# valid one.
+def _FailedTickChangesNothing():
+  scheduling_service = _NewService()
+  try:
+    scheduling_service._Tick([_Plugin('a', _T0, _T0 + 3600), dict(_Plugin('b', _T0, _T0 + 3600), time=1e20)])
+    return False
+  except (OverflowError, OSError, ValueError):
+    pass
+  return not scheduling_service.announced and len(scheduling_service.scheduler.jobs.Active()) == 0
+
+
+def main(argv):
+  num_failures = 0
+  for request in INVALID_REQUESTS:
+    error = service._Invalid(request)
+    num_failures += int(error is None)
+    print('%s: rejects %r: %s' % ('ok' if error else 'FAILED', request, error))
+  ok = _FailedTickChangesNothing()
+  num_failures += int(not ok)
+  print('%s: failed tick changes nothing' % ('ok' if ok else 'FAILED'))
+  for (name, ticks, check) in CASES:
+    scheduling_service = _NewService()
+    try:
+      results = [scheduling_service._Tick(requests) for requests in ticks]
+      ok = check(results)
+    except Exception as e:
+      (results, ok) = (repr(e), False)
+    num_failures += int(not ok)
+    print('%s: %s %s' % ('ok' if ok else 'FAILED', name, results))
+  print('checks: %d failures: %d' % (len(INVALID_REQUESTS) + 1 + len(CASES), num_failures))
+  if num_failures:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,174 @@
+from __future__ import print_function
+
+import datetime
+import sys
+
+import ev
+import schedule
+
+from absl import app
+from absl import flags
+from datetime import timedelta
+
+FLAGS = flags.FLAGS
+
+
+# GreedyScheduler as it was before the job table and the heap-based
+# UpdateJobDemand: lists of EvJob, rescanned and re-sorted in every segment.
+# Kept as the reference. EvJob is not hashable, so jobs are keyed by id().
+class ScanGreedyScheduler(object):
+
+  def __init__(self, scale_factor=1.0, lp_solver='glop'):
+    self.all_jobs = []
+    self.original_jobs = []
+    self.num_unfinished_job = 0
+    self.last_schedule_time = datetime.datetime.min
+    self.peak_history = {}
+    self.scale_factor = scale_factor
+    self.lp_solver = lp_solver
+
+  def AddEvJob(self, job_id, notify_time, arrival_time, end_time, demand, max_charging_rate):
+    self.all_jobs.append(schedule.EvJob(job_id, notify_time, arrival_time, end_time, demand, max_charging_rate))
+    self.original_jobs.append(schedule.EvJob(job_id, notify_time, arrival_time, end_time, demand, max_charging_rate))
+
+  def GetJobBatch(self, ev_jobs, job_to_progress_deadline):
+    job_batch = []
+    cur_progress_deadline = datetime.datetime.min
+    remaining_jobs = [job for job in ev_jobs if job.demand_kwh > 1e-4]
+    for job in remaining_jobs:
+      if job_to_progress_deadline[id(job)] > cur_progress_deadline + timedelta(seconds=1):
+        if len(job_batch) > 0:
+          yield job_batch
+        job_batch = [job]
+        cur_progress_deadline = job_to_progress_deadline[id(job)]
+      elif job_to_progress_deadline[id(job)] > cur_progress_deadline - timedelta(seconds=1):
+        job_batch.append(job)
+      else:
+        sys.exit("jobs are not provided in order")
+    if len(job_batch) > 0:
+      yield job_batch
+    yield []
+
+  def UpdateJobDemand(self, ev_jobs, last_schedule_time, current_time):
+    if last_schedule_time not in self.peak_history:
+      return
+    old_ev_jobs = [job for job in ev_jobs if job.start_time < current_time]
+    total = self.peak_history[last_schedule_time]
+    job_to_progress_deadline = {}
+    for job in old_ev_jobs:
+      job_to_progress_deadline[id(job)] = job.end_time - timedelta(hours = job.demand_kwh / job.max_charging_rate)
+    start = last_schedule_time
+    while True:
+      total_rate = total
+      schedule = []
+      last_progress_deadline = datetime.datetime.min
+      arrived_jobs = [job for job in old_ev_jobs if job.start_time <= start and job.end_time > start]
+      arrived_jobs.sort(key=lambda job: job_to_progress_deadline[id(job)])
+      duration = min([job.start_time for job in old_ev_jobs if job.start_time > start] + [current_time]) - start
+      generator = self.GetJobBatch(arrived_jobs, job_to_progress_deadline)
+      while True:
+        job_batch = next(generator)
+        if len(job_batch) == 0:
+          break
+        total_max_charging_rate = 0.0
+        for job in job_batch:
+          total_max_charging_rate += job.max_charging_rate
+        if total_max_charging_rate <= total_rate:
+          fraction = 1.0
+        else:
+          fraction = total_rate / total_max_charging_rate
+          current_progress_deadline = job_to_progress_deadline[id(job_batch[0])]
+          if last_progress_deadline > datetime.datetime.min and fraction < 1 - 1e-4:
+            duration = min(duration, timedelta(seconds=(current_progress_deadline - last_progress_deadline).total_seconds() / (1 - fraction)))
+        last_progress_deadline = job_to_progress_deadline[id(job_batch[0])]
+        for job in job_batch:
+          schedule.append((job, fraction))
+          duration = min(duration, timedelta(hours=job.demand_kwh / fraction))
+        total_rate -= total_max_charging_rate
+        if total_rate <= 1e-4:
+          next_job_batch = next(generator)
+          if len(next_job_batch) > 0 and fraction > 0:
+            duration = min(duration, timedelta(seconds=(job_to_progress_deadline[id(next_job_batch[0])] - last_progress_deadline).total_seconds() / fraction))
+          break
+      end = min(start + duration, current_time)
+      duration = end - start
+      for (job, fraction) in schedule:
+        job_to_progress_deadline[id(job)] += timedelta(seconds=(duration.total_seconds() * fraction))
+        job.demand_kwh -= job.max_charging_rate * fraction * duration.total_seconds() / 3600.0
+      start = end
+      if start == current_time:
+        break
+
+
+  def ComputePeak(self, ev_jobs):
+    (peak, dummy) = schedule.ComputeOptimalPeak(ev_jobs, self.lp_solver)
+    return peak
+
+  def GetTotalRate(self):
+    return self.ComputePeak(self.all_jobs) * self.scale_factor
+
+  def Schedule(self, schedule_time):
+    self.UpdateJobDemand(self.all_jobs, self.last_schedule_time, schedule_time)
+    for idx in range(len(self.all_jobs) - 1, -1, -1):
+      self.all_jobs[idx].start_time = schedule_time
+      if self.all_jobs[idx].end_time <= schedule_time and self.all_jobs[idx].demand_kwh > 1e-4:
+        self.num_unfinished_job += 1
+      if self.all_jobs[idx].demand_kwh <= 1e-4 or self.all_jobs[idx].end_time <= schedule_time:
+        self.all_jobs.pop(idx)
+    peak_charging_rate = self.GetTotalRate()
+    total_max_charging_rate = 0.0
+    for job in self.all_jobs:
+      total_max_charging_rate += job.max_charging_rate
+    self.peak_history[schedule_time] = min(total_max_charging_rate, peak_charging_rate)
+    self.last_schedule_time = schedule_time
+
+  def Snapshot(self):
+    return [(job.id, job.demand_kwh) for job in self.all_jobs], self.num_unfinished_job, self.peak_history[self.last_schedule_time]
+
+
+class ScanEpsScheduler(ScanGreedyScheduler):
+
+  def GetTotalRate(self):
+    return self.ComputePeak(self.original_jobs) * self.scale_factor
+
+
+def Snapshot(scheduler):
+  handles = scheduler.jobs.Active()
+  return (list(zip(scheduler.jobs.Ids(handles), scheduler.jobs.demand[handles].tolist())), scheduler.num_unfinished_job,
+          scheduler.schedule_history.LastTotalRate())
+
+
+# Replays the Caltech ACN days through GreedyScheduler and EpsScheduler next
+# to the reference implementation and checks that every Schedule call leaves
+# the same remaining demand, unfinished count and rate.
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  schedule_slot = datetime.timedelta(minutes=15)
+  num_ticks = 0
+  num_mismatches = 0
+  for data in ev.StreamDataBatch(time_period[0], time_period[1], datetime.timedelta(hours=24)):
+    pairs = [(schedule.GreedyScheduler(FLAGS.scale, FLAGS.lp_solver), ScanGreedyScheduler(FLAGS.scale, FLAGS.lp_solver)),
+             (schedule.EpsScheduler(FLAGS.scale, FLAGS.lp_solver), ScanEpsScheduler(FLAGS.scale, FLAGS.lp_solver))]
+    last_schedule_time = datetime.datetime.min
+    data.sort(key=lambda record : record.reserve_time)
+    for record in data:
+      max_charging_rate = record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time)
+      for pair in pairs:
+        for scheduler in pair:
+          scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+      if record.reserve_time > last_schedule_time + schedule_slot:
+        for (scheduler, reference) in pairs:
+          scheduler.Schedule(record.reserve_time)
+          reference.Schedule(record.reserve_time)
+          num_ticks += 1
+          if Snapshot(scheduler) != reference.Snapshot():
+            num_mismatches += 1
+            print('mismatch at', record.reserve_time, scheduler.Name())
+        last_schedule_time = record.reserve_time
+  print('ticks: %d mismatches: %d' % (num_ticks, num_mismatches))
+  if num_mismatches:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
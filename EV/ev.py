@@ -1,9 +1,18 @@
 from __future__ import print_function
 
 import collections
+import concurrent.futures
 import datetime
-import json
+import functools
+import itertools
+import sys
+import time
 
+import acn_data
+import instrument
+import numpy as np
+import peak_cache
+import results
 import schedule
 
 from absl import app
@@ -17,80 +26,253 @@ EvRecord = collections.namedtuple('EvRecord', ['id', 'reserve_time', 'start_time
 
 flags.DEFINE_float('scale', 1.05, 'scaling factor')
 flags.DEFINE_float('prob', 0.5, 'reserve probability')
+flags.DEFINE_float('reserve_lead_hours', 3.0, 'how long before its start a reserved session is announced')
+flags.DEFINE_bool('continuous', False, 'also run the max rate and fix rate schedulers, which reschedule at every arrival')
+flags.DEFINE_bool('rolling_horizon', False, 'run the whole period without resetting the schedulers every day, with a rolling peak LP for '
+                  'the eps scheduler')
+flags.DEFINE_float('schedule_slot_min', 15.0, 'minimum time between two ticks of the online schedulers in minutes')
+flags.DEFINE_enum('lp_solver', 'glop', ['glop', 'highs', 'pdlp', 'flow'], 'solver for the optimal peak')
+flags.DEFINE_bool('incremental_lp', False, 'keep the peak LP of the eps scheduler in GLOP between ticks')
+flags.DEFINE_float('lp_slot_sec', 900.0, 'length of the slots of the optimal peak LP in seconds')
+flags.DEFINE_bool('event_grid', False, 'let the optimal peak LP change rates only at job start and end times')
+flags.DEFINE_integer('peak_cache_entries', 0, 'number of optimal-peak solves to keep in memory per process, 0 for no cache')
+flags.DEFINE_string('peak_cache_dir', '', 'directory to also keep optimal-peak solves in, shared between processes and runs')
+flags.DEFINE_string('results', '', 'file to also write a row per day and scheduler to, as .npz for a path ending in it, else as CSV')
+flags.DEFINE_string('trace', '', 'file to write a Chrome trace of the instrumented phases to, see instrument.py; also prints their '
+                    'totals per scheduler')
+flags.DEFINE_integer('workers', 1, 'number of processes to simulate days in, 1 to simulate them in this process')
 
-def ToDateTime(epoc_time_ms):
-  epoc_time_s = float(epoc_time_ms) / 1000.0
-  return datetime.datetime.fromtimestamp(epoc_time_s)
+DATA_FILE = './Caltech_ACN_Apr_15_Sept_18.json'
 
-def LoadData(start_time, end_time):
-  with open("./Caltech_ACN_Apr_15_Sept_18.json") as data_file:
-    number = next(data_file).strip()
-    jsons = [json.loads(line) for line in data_file]
-  records = []
+def ToEpochSeconds(date_time):
+  return time.mktime(date_time.timetuple()) + date_time.microsecond / 1e6
+
+# Deals out reservations to num_sessions sessions in turn, one in every
+# 1 / prob.
+def ReserveFlags(num_sessions, prob):
+  reserved = np.zeros(num_sessions, dtype=bool)
   sum = 0.0
-  for line in jsons:
-    record_start_time = ToDateTime(line['start']['$date']['$numberLong'])
-    if record_start_time < start_time:
-      continue
-    record_end_time = ToDateTime(line['end']['$date']['$numberLong'])
-    if record_end_time > end_time:
-      continue
-    sum += FLAGS.prob
+  for i in range(num_sessions):
+    sum += prob
     if sum >= 1.0:
-      records.append(EvRecord(line['_id']['$oid'], record_start_time - datetime.timedelta(hours=3), record_start_time, record_end_time,
-                              float(line['kWh_delivered']['$numberDouble']),
-	   		      ToDateTime(line['done_charging']['$date']['$numberLong']), line['space_number']))
+      reserved[i] = True
       sum -= 1.0
+  return reserved
+
+# Returns the rows of the sessions that start and end within
+# [start_time, end_time] in order of start time, and which of them are
+# reserved with probability prob. Reservations follow the order of the file.
+def SelectSessions(columns, start_time, end_time, prob):
+  end_sec = ToEpochSeconds(end_time)
+  rows = acn_data.StartRange(columns, ToEpochSeconds(start_time), end_sec)
+  rows = rows[columns['end_sec'][rows] <= end_sec]
+  reserved = np.zeros(len(rows), dtype=bool)
+  reserved[np.argsort(rows, kind='mergesort')] = ReserveFlags(len(rows), prob)
+  return rows, reserved
+
+# Reserved sessions are announced reserve_lead before they start, the others
+# when they start. reserve_lead is a timedelta, or an array of the lead of
+# every row in hours.
+def MakeRecords(columns, rows, reserved, reserve_lead):
+  with instrument.Span('load_records'):
+    ids = columns['id_values'][columns['id_code'][rows]].tolist()
+    locations = columns['location_values'][columns['location_code'][rows]].tolist()
+    if isinstance(reserve_lead, np.ndarray):
+      reserve_leads = [datetime.timedelta(hours=lead) for lead in reserve_lead.tolist()]
     else:
-      records.append(EvRecord(line['_id']['$oid'], record_start_time, record_start_time, record_end_time,
-                              float(line['kWh_delivered']['$numberDouble']),
-	   		      ToDateTime(line['done_charging']['$date']['$numberLong']), line['space_number']))
-  records.sort(key=lambda record : record.start_time)
+      reserve_leads = itertools.repeat(reserve_lead)
+    records = []
+    for (record_id, start_sec, end_sec, energy_kwh, done_charging_sec, location, is_reserved, lead) in zip(
+        ids, columns['start_sec'][rows].tolist(), columns['end_sec'][rows].tolist(), columns['energy_kwh'][rows].tolist(),
+        columns['done_charging_sec'][rows].tolist(), locations, reserved.tolist(), reserve_leads):
+      record_start_time = datetime.datetime.fromtimestamp(start_sec)
+      reserve_time = record_start_time - lead if is_reserved else record_start_time
+      records.append(EvRecord(record_id.decode('utf-8'), reserve_time, record_start_time, datetime.datetime.fromtimestamp(end_sec),
+                              energy_kwh, datetime.datetime.fromtimestamp(done_charging_sec), location.decode('utf-8')))
   return records
 
+# Returns the sessions that start and end within [start_time, end_time], by
+# start time. Reads the columnar cache of DATA_FILE, see acn_data.
+def LoadData(start_time, end_time):
+  columns = acn_data.LoadColumns(DATA_FILE)
+  rows, reserved = SelectSessions(columns, start_time, end_time, FLAGS.prob)
+  return MakeRecords(columns, rows, reserved, datetime.timedelta(hours=FLAGS.reserve_lead_hours))
+
 def ToHours(time_delta):
   return time_delta.total_seconds() / 3600.0
 
-def DataBatch(data, stime, delta):
-  batch = []
-  start_time = stime
-  for d in data:
-    if d.start_time > start_time + delta:
-      yield batch
-      batch = [d]
-      start_time += delta
-    else:
-      batch.append(d)
-  yield batch
+# Returns the (begin, end) positions in rows of the batches of sessions to
+# simulate together. rows must be in order of start time. A batch ends before
+# the first session that starts more than delta after the batch's start time,
+# and the next batch starts delta after it.
+def BatchSlices(columns, rows, start_time, delta):
+  slices = []
+  batch_start = 0
+  batch_end_time = start_time + delta
+  batch_end_sec = ToEpochSeconds(batch_end_time)
+  for i, start_sec in enumerate(columns['start_sec'][rows].tolist()):
+    if start_sec > batch_end_sec:
+      slices.append((batch_start, i))
+      batch_start = i
+      batch_end_time += delta
+      batch_end_sec = ToEpochSeconds(batch_end_time)
+  slices.append((batch_start, len(rows)))
+  return slices
+
+# Yields the records of the sessions LoadData(start_time, end_time) would
+# return, in the batches of BatchSlices, building the records of each batch
+# only when it is reached.
+def StreamDataBatch(start_time, end_time, delta):
+  columns = acn_data.LoadColumns(DATA_FILE)
+  rows, reserved = SelectSessions(columns, start_time, end_time, FLAGS.prob)
+  reserve_lead = datetime.timedelta(hours=FLAGS.reserve_lead_hours)
+  for (begin, end) in BatchSlices(columns, rows, start_time, delta):
+    yield MakeRecords(columns, rows[begin:end], reserved[begin:end], reserve_lead)
+
+# Scheduler settings, passed to the workers explicitly rather than through
+# FLAGS.
+SimConfig = collections.namedtuple('SimConfig', ['scale', 'lp_solver', 'incremental_lp', 'lp_slot_sec', 'event_grid', 'schedule_slot_min',
+                                                 'peak_cache_entries', 'peak_cache_dir', 'continuous',
+                                                 'rolling_horizon', 'instrument'])
+
+def SimConfigFromFlags():
+  return SimConfig(FLAGS.scale, FLAGS.lp_solver, FLAGS.incremental_lp, FLAGS.lp_slot_sec, FLAGS.event_grid, FLAGS.schedule_slot_min,
+                   FLAGS.peak_cache_entries, FLAGS.peak_cache_dir, FLAGS.continuous, FLAGS.rolling_horizon,
+                   bool(FLAGS.trace))
+
+# Returns the peak_cache.PeakCache of this process for config, or None.
+def GetPeakCache(config):
+  if config.peak_cache_entries <= 0:
+    return None
+  return peak_cache.GetCache(config.peak_cache_entries, config.peak_cache_dir or None)
+
+# Returns the continuous, slotted and offline schedulers RunDay runs for
+# config, with the offline one only if oracle.
+def MakeSchedulers(config, cache, oracle=True):
+  continuous_schedulers = [schedule.MaxRateScheduler(False), schedule.FixRateScheduler(False)] if config.continuous else []
+  slotted_schedulers = [schedule.GreedyScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid, cache),
+                        schedule.EpsScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid, cache,
+                                              config.rolling_horizon)]
+  # slotted_schedulers = []
+  offline_schedulers = [schedule.OracleScheduler(config.lp_solver, config.lp_slot_sec, config.event_grid, cache, config.rolling_horizon)] if oracle else []
+  return continuous_schedulers, slotted_schedulers, offline_schedulers
+
+# Replays a batch of sessions through the schedulers in order of
+# announcement. The continuous ones reschedule at every announcement, the
+# slotted ones at most once every schedule_slot_min minutes and the offline
+# ones once at the end. Returns the number of ticks of the slotted ones.
+def Replay(data, continuous_schedulers, slotted_schedulers, offline_schedulers, schedule_slot_min):
+  last_schedule_time = datetime.datetime.min
+  schedule_slot = datetime.timedelta(minutes=schedule_slot_min)
+  num_ticks = 0
+  data.sort(key=lambda record : record.reserve_time)
+  for record in data:
+    max_charging_rate = record.energy_charged_kwh / ToHours(record.done_charging - record.start_time)
+    for scheduler in continuous_schedulers:
+      scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+      scheduler.TimedSchedule(record.reserve_time)
+    for scheduler in slotted_schedulers + offline_schedulers:
+      scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+    if record.reserve_time > last_schedule_time + schedule_slot:
+      for scheduler in slotted_schedulers:
+        scheduler.TimedSchedule(record.reserve_time)
+      last_schedule_time = record.reserve_time
+      num_ticks += 1
+  for scheduler in offline_schedulers:
+    scheduler.TimedSchedule(datetime.datetime.max)
+  return num_ticks
+
+# Runs the schedulers over one batch of sessions. Returns the Summary() of
+# every scheduler, the offline optimal one last, the (name, number, seconds)
+# of the peak solves of the online ones, what the peak cache counted
+# meanwhile and, with config.instrument, what instrument recorded, else None.
+# Without oracle the offline optimal scheduler is left out, see RunOracle.
+def RunDay(data, config, oracle=True):
+  if config.instrument:
+    instrument.Enable()
+  cache = GetPeakCache(config)
+  cache_stats = collections.Counter(cache.stats) if cache else collections.Counter()
+  (continuous_schedulers, slotted_schedulers, offline_schedulers) = MakeSchedulers(config, cache, oracle)
+  Replay(data, continuous_schedulers, slotted_schedulers, offline_schedulers, config.schedule_slot_min)
+  summaries = [scheduler.Summary() for scheduler in continuous_schedulers + slotted_schedulers + offline_schedulers]
+  peak_solves = [(scheduler.Name(), scheduler.num_peak_solves, scheduler.peak_time_sec) for scheduler in slotted_schedulers]
+  return summaries, peak_solves, (collections.Counter(cache.stats) - cache_stats if cache else cache_stats), instrument.Collect()
+
+# Returns the Summary() of the offline optimal scheduler over a batch of
+# sessions. It only depends on the sessions, not on when they are announced
+# or on the settings of the online schedulers.
+def RunOracle(data, config):
+  scheduler = schedule.OracleScheduler(config.lp_solver, config.lp_slot_sec, config.event_grid, GetPeakCache(config))
+  for record in sorted(data, key=lambda record : record.start_time):
+    max_charging_rate = record.energy_charged_kwh / ToHours(record.done_charging - record.start_time)
+    scheduler.AddEvJob(record.id, record.start_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
+  scheduler.TimedSchedule(datetime.datetime.max)
+  return scheduler.Summary()
+
+# Yields fn(item) for every item in order. With workers > 1 the calls run in
+# a pool of that many processes, with at most 2 * workers of them in flight
+# so that iterable is only consumed as the workers catch up.
+def OrderedMap(fn, iterable, workers):
+  if workers <= 1:
+    for item in iterable:
+      yield fn(item)
+    return
+  executor = concurrent.futures.ProcessPoolExecutor(workers)
+  try:
+    pending = collections.deque()
+    for item in iterable:
+      pending.append(executor.submit(fn, item))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+  finally:
+    executor.shutdown()
 
 def main(argv):
   time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
-  data = LoadData(time_period[0], time_period[1])
   # data = [EvRecord('1', datetime.datetime(2018, 4, 18, 0, 0, 0), datetime.datetime(2018, 4, 18, 1, 0, 0), 20, datetime.datetime(2018, 4, 18, 0, 30, 0), '121'), EvRecord('2', datetime.datetime(2018, 4, 18, 0, 30, 0), datetime.datetime(2018, 4, 18, 2, 0, 0), 30, datetime.datetime(2018, 4, 18, 1, 0, 0), '122'), EvRecord('3', datetime.datetime(2018, 4, 18, 1, 0, 0), datetime.datetime(2018, 4, 18, 3, 0, 0), 25, datetime.datetime(2018, 4, 18, 2, 0, 0), '123')]
 
-  for data in DataBatch(LoadData(time_period[0], time_period[1]), time_period[0], datetime.timedelta(hours=24)):
-    # continuous_schedulers = [schedule.MaxRateScheduler(), schedule.FixRateScheduler()]
-    continuous_schedulers = []
-    slotted_schedulers = [schedule.GreedyScheduler(FLAGS.scale), schedule.EpsScheduler(FLAGS.scale)]
-    # slotted_schedulers = []
-    offline_schedulers = [schedule.OracleScheduler()]
-    last_schedule_time = datetime.datetime.min
-    schedule_slot = datetime.timedelta(minutes=15)
-    data.sort(key=lambda record : record.reserve_time)
-    for record in data:
-      max_charging_rate = record.energy_charged_kwh / ToHours(record.done_charging - record.start_time)
-      for scheduler in continuous_schedulers:
-        scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
-        scheduler.Schedule(record.reserve_time)
-      for scheduler in slotted_schedulers + offline_schedulers:
-        scheduler.AddEvJob(record.id, record.reserve_time, record.start_time, record.end_time, record.energy_charged_kwh, max_charging_rate)
-      if record.reserve_time > last_schedule_time + schedule_slot:
-        for scheduler in slotted_schedulers:
-          scheduler.Schedule(record.reserve_time)
-        last_schedule_time = record.reserve_time
-    for scheduler in offline_schedulers:
-      scheduler.Schedule(datetime.datetime.max)
-    Scheduler.Plot(continuous_schedulers + slotted_schedulers + offline_schedulers, time_period, False)
+  # Days are independent, so they can be simulated in any process. Results are
+  # printed in day order either way, so the output does not depend on
+  # --workers.
+  config = SimConfigFromFlags()
+  if FLAGS.rolling_horizon:
+    batches = [LoadData(time_period[0], time_period[1])]
+  else:
+    batches = StreamDataBatch(time_period[0], time_period[1], datetime.timedelta(hours=24))
+  if config.instrument:
+    instrument.Enable()
+  trace = instrument.Trace()
+  peak_solves = collections.OrderedDict()
+  cache_stats = collections.Counter()
+  setting = (config.scale, FLAGS.prob, FLAGS.reserve_lead_hours, config.schedule_slot_min)
+  rows = []
+  for i, (summaries, day_peak_solves, day_cache_stats, day_metrics) in enumerate(
+      OrderedMap(functools.partial(RunDay, config=config), batches, FLAGS.workers)):
+    cache_stats.update(day_cache_stats)
+    for summary in summaries:
+      Scheduler.PrintSummary(summary)
+    day = (time_period[0] + datetime.timedelta(hours=24) * i).strftime('%Y-%m-%d')
+    trace.Add(day_metrics, day)
+    rows.extend(results.Rows(day, setting, summaries, summaries[-1].peak))
+    for (name, day_num_solves, day_solve_sec) in day_peak_solves:
+      (num_solves, solve_sec) = peak_solves.get(name, (0, 0.0))
+      peak_solves[name] = (num_solves + day_num_solves, solve_sec + day_solve_sec)
+  if FLAGS.results:
+    results.Write(FLAGS.results, rows)
+  if FLAGS.trace:
+    # What this process recorded outside RunDay, such as loading the data
+    # for the workers.
+    trace.Add(instrument.Collect())
+    trace.Write(FLAGS.trace)
+    for line in trace.SummaryLines():
+      print(line, file=sys.stderr)
+  for name in peak_solves:
+    print(name, "'s peak solves: ", peak_solves[name][0], " seconds: ", peak_solves[name][1], file=sys.stderr)
+  if config.peak_cache_entries > 0:
+    print('peak cache', ' '.join('%s: %d' % (stat, cache_stats[stat]) for stat in ['hits', 'disk_hits', 'misses', 'evictions', 'disk_writes']),
+          file=sys.stderr)
   """
   ev_jobs = [schedule.EvJob('1', datetime.datetime(2018, 4, 18, 0, 10), datetime.datetime(2018, 4, 18, 0, 10), datetime.datetime(2018, 4, 18, 2, 15), 3, 2), schedule.EvJob('2', datetime.datetime(2018, 4, 18, 0, 0), datetime.datetime(2018, 4, 18, 0, 0), datetime.datetime(2018, 4, 18, 3, 0), 6, 2)]
   print("Solution:", schedule.ComputeOptimalPeak(ev_jobs))
@@ -0,0 +1,93 @@
+import numpy as np
+
+# Columnar record of the rates a scheduler set over time.
+#
+# Each Record() appends a time and the total rate from then on to growable
+# arrays. Times must not decrease; recording the last time again replaces
+# its row. With detail, the rate of every job is kept as well, in CSR form:
+# job_offsets[i]:job_offsets[i + 1] are row i's entries in job_ids and
+# job_rates. Without detail only the totals are kept, which is all a summary
+# needs.
+#
+# The peak, the energy delivered up to the last recorded time and the load
+# factor are kept up to date as rows come in.
+
+
+class ScheduleHistory(object):
+
+  def __init__(self, detail=True, capacity=256):
+    self.detail = detail
+    self.size = 0
+    self.times = np.zeros(capacity, dtype='datetime64[us]')
+    self.total_rates = np.zeros(capacity)
+    self.peak = 0.0
+    self.energy_kwh = 0.0
+    if detail:
+      self.job_offsets = [0]
+      self.job_ids = []
+      self.job_rates = np.zeros(capacity)
+
+  def _Grow(self):
+    capacity = 2 * len(self.times)
+    self.times = np.concatenate([self.times, np.zeros(capacity - len(self.times), dtype=self.times.dtype)])
+    self.total_rates = np.concatenate([self.total_rates, np.zeros(capacity - len(self.total_rates))])
+
+  def _DropLast(self):
+    self.size -= 1
+    if self.size > 0:
+      hours = (self.times[self.size] - self.times[self.size - 1]).astype(np.int64) / 3.6e9
+      self.energy_kwh -= self.total_rates[self.size - 1] * hours
+    if self.total_rates[self.size] >= self.peak:
+      self.peak = float(self.total_rates[:self.size].max()) if self.size else 0.0
+    if self.detail:
+      self.job_offsets.pop()
+      del self.job_ids[self.job_offsets[-1]:]
+
+  # Records that the scheduler set the total rate total_rate at
+  # schedule_time, and the rate job_rates[i] for job job_ids[i] if detailed.
+  def Record(self, schedule_time, total_rate, job_ids=(), job_rates=()):
+    schedule_time = np.datetime64(schedule_time, 'us')
+    if self.size and schedule_time == self.times[self.size - 1]:
+      self._DropLast()
+    assert self.size == 0 or schedule_time > self.times[self.size - 1]
+    if self.size == len(self.times):
+      self._Grow()
+    if self.size > 0:
+      hours = (schedule_time - self.times[self.size - 1]).astype(np.int64) / 3.6e9
+      self.energy_kwh += self.total_rates[self.size - 1] * hours
+    self.times[self.size] = schedule_time
+    self.total_rates[self.size] = total_rate
+    self.size += 1
+    if self.size == 1 or total_rate > self.peak:
+      self.peak = float(total_rate)
+    if self.detail:
+      offset = self.job_offsets[-1]
+      if offset + len(job_rates) > len(self.job_rates):
+        self.job_rates = np.concatenate([self.job_rates, np.zeros(max(offset + len(job_rates), 2 * len(self.job_rates)) - len(self.job_rates))])
+      self.job_rates[offset:offset + len(job_rates)] = job_rates
+      self.job_ids.extend(job_ids)
+      self.job_offsets.append(offset + len(job_rates))
+
+  def Times(self):
+    return self.times[:self.size]
+
+  def TotalRates(self):
+    return self.total_rates[:self.size]
+
+  def LastTotalRate(self):
+    return self.total_rates[self.size - 1]
+
+  # Returns a dict of job id to rate for row i.
+  def JobRates(self, i):
+    return dict(zip(self.job_ids[self.job_offsets[i]:self.job_offsets[i + 1]],
+                    self.job_rates[self.job_offsets[i]:self.job_offsets[i + 1]].tolist()))
+
+  # Returns the mean rate over the recorded time over the peak.
+  def LoadFactor(self):
+    if self.size < 2 or self.peak <= 0:
+      return 0.0
+    hours = (self.times[self.size - 1] - self.times[0]).astype(np.int64) / 3.6e9
+    return self.energy_kwh / hours / self.peak
+
+  def Clear(self):
+    self.__init__(self.detail)
@@ -0,0 +1,170 @@
+import atomic_file
+import collections
+import json
+import os
+import time
+
+# Opt-in timers and counters for the hot paths of the schedulers.
+#
+# Code marks a phase with
+#
+#   with instrument.Span('lp_solve'):
+#     ...
+#
+# and a quantity with instrument.Count('lp_rows', n). Both do nothing until
+# Enable() is called in the process, so that disabled they cost one global
+# lookup. Enabled, spans and counts are aggregated per scheduler, the one
+# named by the innermost Span(name, scheduler=...) around them, and with
+# trace also kept as Chrome trace events. Collect() hands over and resets
+# what a process recorded, as plain data that can be pickled back from a
+# worker; a Trace merges such collections per day and writes them out.
+
+_recorder = None
+
+
+class _NullSpan(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Recorder(object):
+
+  def __init__(self, trace):
+    self.trace = trace
+    self.scheduler = ''
+    self.Reset()
+
+  def Reset(self):
+    self.events = []
+    # (scheduler, name) to [count, seconds, max seconds] for spans and to
+    # [count, total, max] for counters.
+    self.spans = collections.OrderedDict()
+    self.counters = collections.OrderedDict()
+
+  def AddSpan(self, name, start, seconds):
+    stats = self.spans.setdefault((self.scheduler, name), [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] = max(stats[2], seconds)
+    if self.trace:
+      self.events.append({'name': name, 'cat': self.scheduler or 'main', 'ph': 'X', 'ts': start * 1e6, 'dur': seconds * 1e6,
+                          'pid': os.getpid(), 'tid': 0})
+
+  def Count(self, name, value):
+    stats = self.counters.setdefault((self.scheduler, name), [0, 0.0, value])
+    stats[0] += 1
+    stats[1] += value
+    stats[2] = max(stats[2], value)
+    if self.trace:
+      self.events.append({'name': name, 'cat': self.scheduler or 'main', 'ph': 'C', 'ts': time.time() * 1e6, 'pid': os.getpid(),
+                          'args': {name: value}})
+
+
+class _Span(object):
+
+  def __init__(self, recorder, name, scheduler):
+    self.recorder = recorder
+    self.name = name
+    self.scheduler = scheduler
+
+  def __enter__(self):
+    self.outer_scheduler = self.recorder.scheduler
+    if self.scheduler is not None:
+      self.recorder.scheduler = self.scheduler
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *args):
+    self.recorder.AddSpan(self.name, self.start, time.time() - self.start)
+    self.recorder.scheduler = self.outer_scheduler
+    return False
+
+
+# Starts recording in this process, with trace events if trace.
+def Enable(trace=True):
+  global _recorder
+  if _recorder is None:
+    _recorder = _Recorder(trace)
+
+def Disable():
+  global _recorder
+  _recorder = None
+
+def Enabled():
+  return _recorder is not None
+
+# Returns a context manager that times its body as name, attributed to
+# scheduler if given, else to the scheduler of the enclosing span.
+def Span(name, scheduler=None):
+  if _recorder is None:
+    return _NULL_SPAN
+  return _Span(_recorder, name, scheduler)
+
+# Adds value to the counter name.
+def Count(name, value=1):
+  if _recorder is not None:
+    _recorder.Count(name, value)
+
+# Returns what was recorded since Enable() or the last Collect() and starts
+# over, or None when disabled.
+def Collect():
+  if _recorder is None:
+    return None
+  collected = {'events': _recorder.events, 'spans': list(_recorder.spans.items()), 'counters': list(_recorder.counters.items())}
+  _recorder.Reset()
+  return collected
+
+
+# Collections of one or more processes, aggregated per day and scheduler.
+class Trace(object):
+
+  def __init__(self):
+    self.events = []
+    # (day, scheduler, name) to stats as in _Recorder.
+    self.spans = collections.OrderedDict()
+    self.counters = collections.OrderedDict()
+
+  def Add(self, collected, day=''):
+    if collected is None:
+      return
+    for event in collected['events']:
+      event.setdefault('args', {})['day'] = day
+      self.events.append(event)
+    for (totals, items) in [(self.spans, collected['spans']), (self.counters, collected['counters'])]:
+      for ((scheduler, name), (count, total, maximum)) in items:
+        stats = totals.setdefault((day, scheduler, name), [0, 0.0, maximum])
+        stats[0] += count
+        stats[1] += total
+        stats[2] = max(stats[2], maximum)
+
+  # Returns lines of the span and counter totals per scheduler over all days.
+  def SummaryLines(self):
+    lines = []
+    for (kind, totals) in [('span', self.spans), ('counter', self.counters)]:
+      merged = collections.OrderedDict()
+      for ((day, scheduler, name), (count, total, maximum)) in totals.items():
+        stats = merged.setdefault((scheduler or 'main', name), [0, 0.0, maximum])
+        stats[0] += count
+        stats[1] += total
+        stats[2] = max(stats[2], maximum)
+      for ((scheduler, name), (count, total, maximum)) in merged.items():
+        if kind == 'span':
+          lines.append('%s %s: calls %d seconds %.3f max %.4f' % (scheduler, name, count, total, maximum))
+        else:
+          lines.append('%s %s: count %d mean %.1f max %g' % (scheduler, name, count, total / count, maximum))
+    return lines
+
+  # Writes the events in the Chrome trace-event format, readable by
+  # chrome://tracing and Perfetto, with the per-day totals under "metrics".
+  def Write(self, path):
+    metrics = [{'kind': 'span', 'day': day, 'scheduler': scheduler, 'name': name, 'count': count, 'seconds': total, 'max_seconds': maximum}
+               for ((day, scheduler, name), (count, total, maximum)) in self.spans.items()]
+    metrics += [{'kind': 'counter', 'day': day, 'scheduler': scheduler, 'name': name, 'count': count, 'total': total, 'max': maximum}
+                for ((day, scheduler, name), (count, total, maximum)) in self.counters.items()]
+    atomic_file.AtomicWrite(path, lambda f : json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms', 'metrics': metrics}, f))
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Struct-of-arrays store for the jobs of a scheduler.
+#
+# A job is an integer handle into columns of times (datetime64[us]), energies
+# and rates (float64). start and demand are what a scheduler moves and
+# charges; arrival and original_demand keep the values the job was added with.
+# rate is the last rate the scheduler gave the job.
+#
+# A job is active while the scheduler still has to charge it. Deactivate()
+# takes it out of Active() but keeps its row, as EpsScheduler needs all jobs
+# ever added, and Free() also hands the row to the next Add(). Active() and
+# Live() list handles in the order the jobs were added, so that results do not
+# depend on which rows were reused.
+
+_TIME_COLUMNS = ['notify', 'arrival', 'start', 'end']
+_FLOAT_COLUMNS = ['original_demand', 'demand', 'max_rate', 'rate']
+
+
+class JobTable(object):
+
+  def __init__(self, capacity=64):
+    self.size = 0
+    self.free = []
+    self.next_seq = 0
+    self.ids = [None] * capacity
+    for name in _TIME_COLUMNS:
+      setattr(self, name, np.zeros(capacity, dtype='datetime64[us]'))
+    for name in _FLOAT_COLUMNS:
+      setattr(self, name, np.zeros(capacity))
+    self.seq = np.zeros(capacity, dtype=np.int64)
+    self.active = np.zeros(capacity, dtype=bool)
+    self.live = np.zeros(capacity, dtype=bool)
+    # Active() in order, kept up to date as jobs come and go.
+    self.active_handles = np.zeros(0, dtype=np.int64)
+
+  def _Grow(self):
+    capacity = 2 * len(self.seq)
+    self.ids.extend([None] * (capacity - len(self.ids)))
+    for name in _TIME_COLUMNS + _FLOAT_COLUMNS + ['seq', 'active', 'live']:
+      column = getattr(self, name)
+      grown = np.zeros(capacity, dtype=column.dtype)
+      grown[:len(column)] = column
+      setattr(self, name, grown)
+
+  # Adds an active job and returns its handle.
+  def Add(self, job_id, notify_time, arrival_time, end_time, demand, max_charging_rate):
+    if self.free:
+      handle = self.free.pop()
+    else:
+      if self.size == len(self.seq):
+        self._Grow()
+      handle = self.size
+      self.size += 1
+    self.ids[handle] = job_id
+    self.notify[handle] = notify_time
+    self.arrival[handle] = arrival_time
+    self.start[handle] = arrival_time
+    self.end[handle] = end_time
+    self.original_demand[handle] = demand
+    self.demand[handle] = demand
+    self.max_rate[handle] = max_charging_rate
+    self.rate[handle] = 0.0
+    self.seq[handle] = self.next_seq
+    self.next_seq += 1
+    self.active[handle] = True
+    self.live[handle] = True
+    # The new job has the highest sequence number.
+    self.active_handles = np.append(self.active_handles, handle)
+    return handle
+
+  def Deactivate(self, handles):
+    self.active[handles] = False
+    if len(handles):
+      self.active_handles = self.active_handles[self.active[self.active_handles]]
+
+  def Free(self, handles):
+    self.Deactivate(handles)
+    self.live[handles] = False
+    self.free.extend(np.asarray(handles).tolist())
+
+  def _InOrder(self, mask):
+    handles = np.nonzero(mask[:self.size])[0]
+    return handles[np.argsort(self.seq[handles], kind='mergesort')]
+
+  # Returns the handles of the active jobs in order of addition.
+  def Active(self):
+    return self.active_handles
+
+  # Returns the handles of all jobs not freed, active or not, in order of
+  # addition.
+  def Live(self):
+    return self._InOrder(self.live)
+
+  def Ids(self, handles):
+    return [self.ids[handle] for handle in np.asarray(handles).tolist()]
+
+  # Returns the jobs as peak_lp.JobArrays would, with the start and demand
+  # they were added with if original. Times are in seconds from origin if
+  # given, else from the earliest start.
+  def Arrays(self, handles, original=False, origin=None):
+    start = (self.arrival if original else self.start)[handles]
+    horizon_start = start.min() if origin is None else np.datetime64(origin, 'us')
+    start_sec = (start - horizon_start).astype(np.int64) / 1e6
+    end_sec = (self.end[handles] - horizon_start).astype(np.int64) / 1e6
+    demand_kwh = (self.original_demand if original else self.demand)[handles]
+    return horizon_start.tolist(), start_sec, end_sec, demand_kwh, self.max_rate[handles]
@@ -0,0 +1,154 @@
+from __future__ import print_function
+
+import collections
+import datetime
+import json
+import sys
+import time
+
+import acn_data
+import ev
+import instrument
+import numpy as np
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('replicates', 20, 'number of random reservation assignments to simulate')
+flags.DEFINE_integer('replicate_seed', 0, 'seed of the reservation assignments; replicate i draws from (seed, i)')
+flags.DEFINE_bool('random_lead', False, 'draw the lead of every reservation uniformly from [0, 2 * --reserve_lead_hours] instead of '
+                  'fixing it at --reserve_lead_hours')
+flags.DEFINE_float('confidence', 0.95, 'confidence level of the intervals')
+flags.DEFINE_integer('days', 0, 'number of days of the Caltech ACN period to simulate, 0 for all')
+flags.DEFINE_string('output', '', 'file to also write the statistics of every replicate to as JSON')
+
+# Estimates how much the competitive ratios of the online schedulers depend on
+# which sessions happen to be reserved. ev.py deals out reservations in turn,
+# one in every 1 / --prob sessions, so a setting has exactly one reservation
+# pattern. Here every replicate instead reserves every session independently
+# with probability --prob, from a random state seeded with
+# (--replicate_seed, replicate), and with --random_lead also draws the lead of
+# every reservation. The online schedulers of ev.RunDay run over every
+# (replicate, day) as independent cells over --workers processes.
+#
+# The sessions are loaded once and the offline optimum of a day, which does
+# not depend on the reservations, is solved once per day. Per replicate and
+# online scheduler the mean and worst competitive ratio over the days and the
+# mean unfinished ratio are taken, as by analysis.py; printed are their mean
+# over the replicates with a bootstrap --confidence interval of that mean, and
+# their spread over the replicates. --scale, --prob, --reserve_lead_hours,
+# --schedule_slot_min, the scheduler flags, --trace and --workers are as for
+# ev.py; --peak_cache_entries and --peak_cache_dir are too, but only the
+# oracle solves repeat between replicates.
+
+STATS = ['mean_cr', 'worst_cr', 'mean_unfinished_ratio']
+
+
+def _RunCell(cell):
+  (data, config) = cell
+  (summaries, peak_solves, cache_stats, metrics) = ev.RunDay(data, config, oracle=False)
+  return summaries, metrics
+
+def _RunOracle(cell):
+  (data, config) = cell
+  if config.instrument:
+    instrument.Enable()
+  return ev.RunOracle(data, config), instrument.Collect()
+
+# Returns which of num_sessions sessions are reserved, each with probability
+# prob, and the lead of every session in hours, drawn from random_state.
+def RandomReservations(num_sessions, prob, reserve_lead_hours, random_lead, random_state):
+  reserved = random_state.random_sample(num_sessions) < prob
+  if random_lead:
+    return reserved, random_state.uniform(0.0, 2.0 * reserve_lead_hours, num_sessions)
+  return reserved, np.full(num_sessions, reserve_lead_hours)
+
+# Returns the mean of values and the bounds of a bootstrap confidence
+# interval of it: the percentiles of the means of resamples of values.
+def BootstrapInterval(values, confidence, random_state, num_resamples=2000):
+  means = values[random_state.randint(len(values), size=(num_resamples, len(values)))].mean(axis=1)
+  tail = 50.0 * (1.0 - confidence)
+  return float(values.mean()), float(np.percentile(means, tail)), float(np.percentile(means, 100.0 - tail))
+
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  delta = datetime.timedelta(hours=24)
+  if FLAGS.days > 0:
+    time_period[1] = min(time_period[1], time_period[0] + FLAGS.days * delta)
+  start = time.time()
+  columns = acn_data.LoadColumns(ev.DATA_FILE)
+  (rows, reserved) = ev.SelectSessions(columns, time_period[0], time_period[1], 0.0)
+  days = [(begin, end) for (begin, end) in ev.BatchSlices(columns, rows, time_period[0], delta) if end > begin]
+  base = ev.SimConfigFromFlags()
+  if base.instrument:
+    instrument.Enable()
+  trace = instrument.Trace()
+
+  optimal_peaks = []
+  for (optimal_summary, metrics) in ev.OrderedMap(
+      _RunOracle, ((ev.MakeRecords(columns, rows[begin:end], reserved[begin:end], datetime.timedelta()), base) for (begin, end) in days),
+      FLAGS.workers):
+    optimal_peaks.append(optimal_summary.peak)
+    trace.Add(metrics, 'oracle')
+  optimal_peaks = np.array(optimal_peaks)
+
+  # Draw every replicate's reservations here rather than in the workers, so
+  # that they do not depend on --workers.
+  def Cells():
+    for replicate in range(FLAGS.replicates):
+      (reserved, lead_hours) = RandomReservations(len(rows), FLAGS.prob, FLAGS.reserve_lead_hours, FLAGS.random_lead,
+                                                  np.random.RandomState([FLAGS.replicate_seed, replicate]))
+      for (begin, end) in days:
+        yield (ev.MakeRecords(columns, rows[begin:end], reserved[begin:end], lead_hours[begin:end]), base)
+
+  # Per scheduler name the peaks and unfinished ratios of every replicate and
+  # day.
+  peaks = collections.OrderedDict()
+  unfinished_ratios = collections.OrderedDict()
+  cell_summaries = ev.OrderedMap(_RunCell, Cells(), FLAGS.workers)
+  for replicate in range(FLAGS.replicates):
+    for day in range(len(days)):
+      (summaries, metrics) = next(cell_summaries)
+      trace.Add(metrics, 'replicate %d' % replicate)
+      for summary in summaries:
+        peaks.setdefault(summary.name, np.zeros((FLAGS.replicates, len(days))))[replicate, day] = summary.peak
+        unfinished_ratios.setdefault(summary.name, np.zeros((FLAGS.replicates, len(days))))[replicate, day] = summary.unfinished_ratio
+
+  # As in analysis.py, days without an optimal peak have no competitive ratio.
+  measured = optimal_peaks > 0
+  random_state = np.random.RandomState(FLAGS.replicate_seed)
+  report = collections.OrderedDict()
+  print('replicates: %d days: %d prob: %g lead hours: %s confidence: %g' % (
+      FLAGS.replicates, len(days), FLAGS.prob, ('random, mean %g' if FLAGS.random_lead else '%g') % FLAGS.reserve_lead_hours,
+      FLAGS.confidence))
+  for name in peaks:
+    ratios = peaks[name][:, measured] / optimal_peaks[measured]
+    replicate_stats = collections.OrderedDict([('mean_cr', ratios.mean(axis=1)), ('worst_cr', ratios.max(axis=1)),
+                                               ('mean_unfinished_ratio', unfinished_ratios[name][:, measured].mean(axis=1))])
+    report[name] = collections.OrderedDict()
+    line = [name]
+    for stat in STATS:
+      values = replicate_stats[stat]
+      (mean, low, high) = BootstrapInterval(values, FLAGS.confidence, random_state)
+      report[name][stat] = {'mean': mean, 'low': low, 'high': high, 'std': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+                            'min': float(values.min()), 'max': float(values.max()), 'replicates': values.tolist()}
+      line.append('%s: %.4f [%.4f, %.4f] std %.4f range %.4f-%.4f' % (stat, mean, low, high, report[name][stat]['std'], values.min(),
+                                                                     values.max()))
+    print(' '.join(line))
+  if FLAGS.output:
+    with open(FLAGS.output, 'w') as f:
+      json.dump({'replicates': FLAGS.replicates, 'replicate_seed': FLAGS.replicate_seed, 'days': len(days), 'scale': base.scale,
+                 'prob': FLAGS.prob, 'reserve_lead_hours': FLAGS.reserve_lead_hours, 'random_lead': FLAGS.random_lead,
+                 'confidence': FLAGS.confidence, 'schedulers': report}, f, indent=1)
+  if FLAGS.trace:
+    trace.Add(instrument.Collect())
+    trace.Write(FLAGS.trace)
+    for line in trace.SummaryLines():
+      print(line, file=sys.stderr)
+  print('cells: %d seconds: %.1f' % (FLAGS.replicates * len(days), time.time() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  app.run(main)
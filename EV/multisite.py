@@ -0,0 +1,158 @@
+from __future__ import print_function
+
+import collections
+import datetime
+import json
+import re
+import sys
+import time
+
+import ev
+import numpy as np
+import results
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('site_map', '', 'JSON file mapping locations to sites, for the locations --site_pattern should not decide')
+flags.DEFINE_string('site_pattern', r'^([A-Za-z]+-\d)', 'regular expression whose first group is the site of a location; locations it does '
+                    'not match are sites of their own')
+flags.DEFINE_list('site_limits', [], 'transformer limits in kW as site=limit, to count the days a site goes over')
+
+# Runs the schedulers of ev.RunDay per site rather than over one pool of
+# sessions: every session goes to the site of its location, by --site_map or
+# else --site_pattern (by default the garage level of a Caltech space, such
+# as CA-3 for CA-303), and every (day, site) gets its own greedy, eps and
+# oracle instances, run as independent cells over --workers processes. A tick
+# of a site only models that site's jobs, so its latency depends on the size
+# of the site and not on how many sites there are.
+#
+# Per day, the summary of every scheduler over all sites is printed, with the
+# aggregate peak of the sum of the sites' rates. At the end the sessions of
+# every site are printed, with the Schedule() calls, milliseconds per call,
+# highest peak and days over --site_limits of each of its schedulers. With
+# --results the site rows (as scheduler@site) and the aggregate rows (as
+# scheduler@all) are written as by ev.py, each with the oracle peak of its own
+# site or of the aggregate.
+# --prob, --reserve_lead_hours, --continuous and the scheduler flags are as for
+# ev.py.
+
+# Returns a function from a location to its site.
+def SiteFunction(site_map, site_pattern):
+  pattern = re.compile(site_pattern)
+
+  def SiteOf(location):
+    if location in site_map:
+      return site_map[location]
+    match = pattern.match(location)
+    return match.group(1) if match and match.groups() else location
+  return SiteOf
+
+# Returns the records of data per site, in order of site.
+def SplitBySite(data, site_of):
+  sites = collections.defaultdict(list)
+  for record in data:
+    sites[site_of(record.location)].append(record)
+  return collections.OrderedDict(sorted(sites.items()))
+
+# Runs the schedulers over the sessions of one site and day. Returns the day
+# and site, the number of sessions, and per scheduler its Summary(), its
+# (times, total rates, time the last session leaves) and its number of
+# Schedule() calls.
+def _RunSiteDay(cell):
+  (day_index, site, data, config) = cell
+  (continuous_schedulers, slotted_schedulers, offline_schedulers) = ev.MakeSchedulers(config, ev.GetPeakCache(config))
+  num_ticks = ev.Replay(data, continuous_schedulers, slotted_schedulers, offline_schedulers, config.schedule_slot_min)
+  schedulers = continuous_schedulers + slotted_schedulers + offline_schedulers
+  num_calls = [len(data)] * len(continuous_schedulers) + [num_ticks] * len(slotted_schedulers) + [1] * len(offline_schedulers)
+  end = np.datetime64(max(record.end_time for record in data), 'us')
+  histories = [(scheduler.schedule_history.Times().copy(), scheduler.schedule_history.TotalRates().copy(), end) for scheduler in schedulers]
+  return day_index, site, len(data), [scheduler.Summary() for scheduler in schedulers], histories, num_calls
+
+# Returns the peak of the sum of the total rates of histories, given as
+# (times, total rates, end) of each site. Every rate holds until the site's
+# next time, the last one until end, when the last session of the site has
+# left.
+def AggregatePeak(histories):
+  histories = [(times, rates, end) for (times, rates, end) in histories if len(times)]
+  if not histories:
+    return 0.0
+  times = np.unique(np.concatenate([times for (times, rates, end) in histories]))
+  total = np.zeros(len(times))
+  for (site_times, rates, end) in histories:
+    index = np.searchsorted(site_times, times, 'right') - 1
+    live = (index >= 0) & (times < end)
+    total[live] += rates[index[live]]
+  return float(total.max())
+
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  delta = datetime.timedelta(hours=24)
+  site_map = {}
+  if FLAGS.site_map:
+    with open(FLAGS.site_map) as f:
+      site_map = json.load(f)
+  site_of = SiteFunction(site_map, FLAGS.site_pattern)
+  limits = dict((site, float(limit)) for (site, limit) in (item.rsplit('=', 1) for item in FLAGS.site_limits))
+  config = ev.SimConfigFromFlags()
+  setting = (config.scale, FLAGS.prob, FLAGS.reserve_lead_hours, config.schedule_slot_min)
+
+  def Cells():
+    for i, data in enumerate(ev.StreamDataBatch(time_period[0], time_period[1], delta)):
+      for site, site_data in SplitBySite(data, site_of).items():
+        yield (i, site, site_data, config)
+
+  start = time.time()
+  rows = []
+  # Per site the number of sessions, and per scheduler name the number and
+  # seconds of its Schedule() calls, its highest peak and its days over the
+  # limit.
+  site_sessions = collections.Counter()
+  site_stats = collections.defaultdict(collections.OrderedDict)
+
+  def FinishDay(day):
+    label = (time_period[0] + delta * day[0][0]).strftime('%Y-%m-%d')
+    num_sessions = [num_records for (i, site, num_records, summaries, histories, num_calls) in day]
+    aggregates = []
+    for j, name in enumerate(summary.name for summary in day[0][3]):
+      site_summaries = [summaries[j] for (i, site, num_records, summaries, histories, num_calls) in day]
+      unfinished_ratio = sum(summary.unfinished_ratio * n for (summary, n) in zip(site_summaries, num_sessions)) / sum(num_sessions)
+      peak = AggregatePeak([histories[j] for (i, site, num_records, summaries, histories, num_calls) in day])
+      aggregates.append(schedule.SchedulerSummary(name + '@all', unfinished_ratio, peak, sum(summary.energy_kwh for summary in site_summaries),
+                                                  sum(summary.run_time_sec for summary in site_summaries)))
+      schedule.Scheduler.PrintSummary(aggregates[-1])
+    for (i, site, num_records, summaries, histories, num_calls) in day:
+      rows.extend(results.Rows(label, setting, [summary._replace(name='%s@%s' % (summary.name, site)) for summary in summaries],
+                               summaries[-1].peak))
+      site_sessions[site] += num_records
+      for (summary, calls) in zip(summaries, num_calls):
+        (total_calls, run_time_sec, peak, days_over) = site_stats[site].get(summary.name, (0, 0.0, 0.0, 0))
+        site_stats[site][summary.name] = (total_calls + calls, run_time_sec + summary.run_time_sec, max(peak, summary.peak),
+                                          days_over + int(site in limits and summary.peak > limits[site]))
+    rows.extend(results.Rows(label, setting, aggregates, aggregates[-1].peak))
+
+  day = []
+  for result in ev.OrderedMap(_RunSiteDay, Cells(), FLAGS.workers):
+    if day and result[0] != day[0][0]:
+      FinishDay(day)
+      day = []
+    day.append(result)
+  if day:
+    FinishDay(day)
+
+  for site in sorted(site_stats):
+    line = ['site %s sessions: %d' % (site, site_sessions[site])]
+    for (name, (calls, run_time_sec, peak, days_over)) in site_stats[site].items():
+      line.append('%s calls: %d ms/call: %.2f peak: %.2f%s' % (name, calls, 1000.0 * run_time_sec / max(calls, 1), peak,
+                                                              ' days over %g kW: %d' % (limits[site], days_over) if site in limits else ''))
+    print(' '.join(line))
+  if FLAGS.results:
+    results.Write(FLAGS.results, rows)
+  print('sites: %d seconds: %.1f' % (len(site_stats), time.time() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  app.run(main)
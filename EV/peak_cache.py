@@ -0,0 +1,110 @@
+import atomic_file
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+# Memoizes optimal-peak solves.
+#
+# A solve is keyed by the SHA-256 of its jobs' (start, end, demand, max rate)
+# tuples, with start and end in seconds from the earliest start and the
+# tuples sorted, plus the slot length, the solver, whether the event grid is
+# used and SolverVersion(), so that a directory kept across runs never serves
+# the solves of other code. The value is the peak and the total rate of every slot. Being
+# relative to the horizon, it is returned as offsets that the caller anchors.
+#
+# Entries are kept in a least-recently-used dict of at most max_entries. With
+# cache_dir they are also written there as one .npy file each, through
+# atomic_file so that worker processes sharing the directory never read a
+# partial file. The directory is not bounded.
+
+# The modules that compute the cached solves or lay out their files.
+SOLVER_FILES = ['peak_cache.py', 'peak_flow.py', 'peak_lp.py']
+
+_solver_version = None
+
+# Returns the SHA-256 of SOLVER_FILES.
+def SolverVersion():
+  global _solver_version
+  if _solver_version is None:
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SOLVER_FILES:
+      digest.update(name.encode('utf-8'))
+      with open(os.path.join(directory, name), 'rb') as f:
+        digest.update(f.read())
+    _solver_version = digest.hexdigest()
+  return _solver_version
+
+
+class PeakCache(object):
+
+  def __init__(self, max_entries=1024, cache_dir=None):
+    self.max_entries = max_entries
+    self.cache_dir = cache_dir
+    self.entries = collections.OrderedDict()
+    self.stats = collections.Counter()
+    if cache_dir and not os.path.isdir(cache_dir):
+      try:
+        os.makedirs(cache_dir)
+      except OSError:
+        # Another process created it first.
+        pass
+
+  @staticmethod
+  def Key(start_sec, end_sec, demand_kwh, max_charging_rate, slot_length_sec, solver, event_grid):
+    jobs = np.stack([start_sec, end_sec, demand_kwh, max_charging_rate]).astype(np.float64)
+    jobs = jobs[:, np.lexsort(jobs[::-1])]
+    digest = hashlib.sha256(np.ascontiguousarray(jobs).tobytes())
+    digest.update(repr((float(slot_length_sec), solver, bool(event_grid), SolverVersion())).encode('utf-8'))
+    return digest.hexdigest()
+
+  def _Path(self, key):
+    return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+  # Returns (peak, slot rates) or None.
+  def Get(self, key):
+    if key in self.entries:
+      value = self.entries.pop(key)
+      self.entries[key] = value
+      self.stats['hits'] += 1
+      return value
+    if self.cache_dir:
+      try:
+        array = np.load(self._Path(key))
+      except (IOError, OSError, ValueError):
+        array = None
+      if array is not None:
+        self.stats['disk_hits'] += 1
+        value = (float(array[0]), array[1:])
+        self._Insert(key, value)
+        return value
+    self.stats['misses'] += 1
+    return None
+
+  def Put(self, key, peak, slot_rates):
+    value = (float(peak), np.asarray(slot_rates, dtype=np.float64))
+    self._Insert(key, value)
+    if self.cache_dir:
+      path = self._Path(key)
+      if os.path.exists(path):
+        return
+      atomic_file.AtomicWrite(path, lambda f : np.save(f, np.concatenate([[value[0]], value[1]])), 'wb')
+      self.stats['disk_writes'] += 1
+
+  def _Insert(self, key, value):
+    self.entries[key] = value
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+      self.stats['evictions'] += 1
+
+
+_caches = {}
+
+# Returns the cache of this process for the given settings, so that settings
+# passed to worker processes map to one cache per process.
+def GetCache(max_entries, cache_dir=None):
+  if (max_entries, cache_dir) not in _caches:
+    _caches[(max_entries, cache_dir)] = PeakCache(max_entries, cache_dir)
+  return _caches[(max_entries, cache_dir)]
@@ -0,0 +1,147 @@
+import collections
+import numpy as np
+import peak_lp
+
+# Exact minimum-peak solver without an LP.
+#
+# On the event grid every job is present for the whole of each cell it touches,
+# so a peak P is feasible iff the network
+#   source -> job j         capacity demand_j
+#   job j -> cell k         capacity max_rate_j * length_k
+#   cell k -> sink          capacity P * length_k
+# carries the full demand. The smallest feasible P is found by Newton's method
+# on the min-cut function: a cut that blocks the flow at P gives the next lower
+# bound on the optimum, and only finitely many cuts exist. Raising P only adds
+# capacity on the sink arcs, so each step resumes from the previous flow.
+
+
+class _FlowNetwork(object):
+
+  def __init__(self, num_nodes):
+    self.edges = [[] for _ in range(num_nodes)]
+    self.head = []
+    self.capacity = []
+
+  # Adds an edge and its reverse, returns the id of the forward edge. The
+  # reverse edge has id ^ 1.
+  def AddEdge(self, tail, head, capacity):
+    self.edges[tail].append(len(self.head))
+    self.head.append(head)
+    self.capacity.append(capacity)
+    self.edges[head].append(len(self.head))
+    self.head.append(tail)
+    self.capacity.append(0.0)
+    return len(self.head) - 2
+
+  def Reachable(self, source, eps):
+    level = [-1] * len(self.edges)
+    level[source] = 0
+    queue = collections.deque([source])
+    while queue:
+      node = queue.popleft()
+      for edge in self.edges[node]:
+        if self.capacity[edge] > eps and level[self.head[edge]] < 0:
+          level[self.head[edge]] = level[node] + 1
+          queue.append(self.head[edge])
+    return level
+
+  # Pushes as much additional flow as possible (Dinic), returns the amount.
+  def MaxFlow(self, source, sink, eps):
+    edges, head, capacity = self.edges, self.head, self.capacity
+    flow = 0.0
+    while True:
+      level = self.Reachable(source, eps)
+      if level[sink] < 0:
+        return flow
+      next_edge = [0] * len(edges)
+      path = []
+      node = source
+      while True:
+        if node == sink:
+          pushed = min(capacity[edge] for edge in path)
+          for edge in path:
+            capacity[edge] -= pushed
+            capacity[edge ^ 1] += pushed
+          flow += pushed
+          path = []
+          node = source
+          continue
+        node_edges = edges[node]
+        next_level = level[node] + 1
+        i = next_edge[node]
+        while i < len(node_edges):
+          edge = node_edges[i]
+          if capacity[edge] > eps and level[head[edge]] == next_level:
+            break
+          i += 1
+        next_edge[node] = i
+        if i == len(node_edges):
+          if node == source:
+            break
+          # Dead end, retreat and never come back.
+          level[node] = -1
+          edge = path.pop()
+          node = head[edge ^ 1]
+          next_edge[node] += 1
+          continue
+        path.append(edge)
+        node = head[edge]
+
+
+# Returns the minimum peak, the event grid and the total charging rate of each
+# cell of the grid. Arguments are as for peak_lp.BuildPeakLp.
+def SolvePeakFlow(start_sec, end_sec, demand_kwh, max_charging_rate):
+  boundaries = peak_lp.EventGrid(start_sec, end_sec)
+  num_cells = len(boundaries) - 1
+  cell_hours = (np.diff(boundaries) / 3600.0).tolist()
+  duration_hours = (end_sec - start_sec) / 3600.0
+  demand = np.minimum(demand_kwh, duration_hours * max_charging_rate)
+  jobs = np.nonzero(demand > 0)[0].tolist()
+  total_demand = float(demand.sum())
+  if total_demand <= 0:
+    return 0.0, boundaries, np.zeros(num_cells)
+  eps = 1e-12 * max(total_demand, 1.0)
+  first_cell = np.searchsorted(boundaries, start_sec).tolist()
+  end_cell = np.searchsorted(boundaries, end_sec).tolist()
+  demand = demand.tolist()
+  rate_caps = max_charging_rate.tolist()
+
+  # Neither the average rate over the whole horizon nor the average rate any
+  # single job needs can exceed the peak.
+  peak = max(total_demand / sum(cell_hours), max(demand[j] / duration_hours[j] for j in jobs))
+  source = 0
+  sink = len(jobs) + num_cells + 1
+  network = _FlowNetwork(sink + 1)
+  for node, j in enumerate(jobs, 1):
+    network.AddEdge(source, node, demand[j])
+    for k in range(first_cell[j], end_cell[j]):
+      network.AddEdge(node, len(jobs) + 1 + k, rate_caps[j] * cell_hours[k])
+  sink_edges = [network.AddEdge(len(jobs) + 1 + k, sink, peak * cell_hours[k]) for k in range(num_cells)]
+
+  flow = 0.0
+  while True:
+    flow += network.MaxFlow(source, sink, eps)
+    if flow >= total_demand - 1e-9 * total_demand:
+      break
+    reachable = network.Reachable(source, eps)
+    cut = 0.0
+    cut_hours = 0.0
+    for node, j in enumerate(jobs, 1):
+      if reachable[node] < 0:
+        cut += demand[j]
+      else:
+        for k in range(first_cell[j], end_cell[j]):
+          if reachable[len(jobs) + 1 + k] < 0:
+            cut += rate_caps[j] * cell_hours[k]
+    for k in range(num_cells):
+      if reachable[len(jobs) + 1 + k] >= 0:
+        cut_hours += cell_hours[k]
+    next_peak = (total_demand - cut) / cut_hours
+    if next_peak <= peak:
+      break
+    for k in range(num_cells):
+      network.capacity[sink_edges[k]] += (next_peak - peak) * cell_hours[k]
+    peak = next_peak
+
+  cell_rate = np.array([network.capacity[edge ^ 1] for edge in sink_edges]) / np.diff(boundaries) * 3600.0
+  return peak, boundaries, cell_rate
@@ -0,0 +1,418 @@
+import collections
+import instrument
+import math
+import numpy as np
+import time
+
+from recordtype import recordtype
+
+# The offline-optimal peak LP in matrix form.
+#
+# Column 0 is the peak; every other column is the charging rate of one job in
+# one cell (the part of a slot that falls inside the job's window).  The first
+# num_slots rows bound the total rate of each slot by the peak, the remaining
+# rows force each job to receive its demand.  The constraint matrix is kept as
+# COO arrays (row, col, val); CsrArrays() converts it for row-wise consumers.
+PeakLp = collections.namedtuple('PeakLp', [
+    'num_slots', 'num_vars', 'objective', 'var_lower', 'var_upper',
+    'row', 'col', 'val', 'row_lower', 'row_upper', 'cell_slot', 'cell_job'])
+
+
+# Converts a list of EvJob into the arrays BuildPeakLp expects. Times are
+# seconds after the earliest start time, which is returned as well.
+def JobArrays(ev_jobs):
+  horizon_start = min(ev_job.start_time for ev_job in ev_jobs)
+  start_sec = np.array([(ev_job.start_time - horizon_start).total_seconds() for ev_job in ev_jobs])
+  end_sec = np.array([(ev_job.end_time - horizon_start).total_seconds() for ev_job in ev_jobs])
+  demand_kwh = np.array([ev_job.demand_kwh for ev_job in ev_jobs], dtype=float)
+  max_charging_rate = np.array([ev_job.max_charging_rate for ev_job in ev_jobs], dtype=float)
+  return horizon_start, start_sec, end_sec, demand_kwh, max_charging_rate
+
+
+# Returns, for ranges [first, first + count), the range each element belongs to
+# and the element itself, flattened.
+def _Ranges(first, count):
+  owner = np.repeat(np.arange(len(first)), count)
+  return owner, first[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(count) - count, count)
+
+
+# Returns the sorted distinct start and end instants of the jobs. Used as cell
+# boundaries, every job is present for the whole of each cell it touches.
+def EventGrid(start_sec, end_sec):
+  return np.unique(np.concatenate([start_sec, end_sec]))
+
+
+# Builds the LP over fixed slots of slot_length_sec starting at 0, or over the
+# cells between consecutive boundaries if those are given.
+def BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate, slot_length_sec=900.0, boundaries=None):
+  with instrument.Span('lp_build'):
+    if boundaries is None:
+      boundaries = np.arange(math.ceil(end_sec.max() / slot_length_sec) + 1) * slot_length_sec
+    num_slots = len(boundaries) - 1
+    first_slot = np.minimum(np.searchsorted(boundaries, start_sec, 'right') - 1, num_slots - 1)
+    num_cells = np.maximum(np.searchsorted(boundaries, end_sec, 'left') - first_slot, 1)
+    cell_job, cell_slot = _Ranges(first_slot, num_cells)
+    cell_begin = np.maximum(start_sec[cell_job], boundaries[cell_slot])
+    cell_end = np.minimum(end_sec[cell_job], boundaries[cell_slot + 1])
+    # Jobs that cannot be fully charged before their deadline get what they can.
+    max_demand = np.minimum(demand_kwh, (end_sec - start_sec) * max_charging_rate / 3600.0)
+
+    cell_col = np.arange(1, len(cell_job) + 1)
+    row = np.concatenate([np.arange(num_slots), cell_slot, num_slots + cell_job])
+    col = np.concatenate([np.zeros(num_slots, dtype=np.int64), cell_col, cell_col])
+    val = np.concatenate([-np.ones(num_slots), np.ones(len(cell_job)), (cell_end - cell_begin) / 3600.0])
+    objective = np.zeros(len(cell_job) + 1)
+    objective[0] = 1.0
+    lp = PeakLp(num_slots=num_slots,
+                num_vars=len(cell_job) + 1,
+                objective=objective,
+                var_lower=np.zeros(len(cell_job) + 1),
+                var_upper=np.concatenate([[np.inf], max_charging_rate[cell_job]]),
+                row=row, col=col, val=val,
+                row_lower=np.concatenate([np.full(num_slots, -np.inf), max_demand]),
+                row_upper=np.concatenate([np.zeros(num_slots), max_demand]),
+                cell_slot=cell_slot,
+                cell_job=cell_job)
+  instrument.Count('lp_rows', len(lp.row_lower))
+  instrument.Count('lp_cols', lp.num_vars)
+  instrument.Count('lp_nonzeros', len(lp.val))
+  return lp
+
+
+# Returns the jobs split into groups that share no slot of slot_length_sec
+# starting at 0, as lists of job indices in order of start. The peak LP of the
+# jobs is the union of the LPs of the groups.
+def SlotComponents(start_sec, end_sec, slot_length_sec=900.0):
+  order = np.argsort(start_sec, kind='mergesort')
+  first_slot = np.floor(start_sec[order] / slot_length_sec)
+  end_slot = np.maximum(np.ceil(end_sec[order] / slot_length_sec), first_slot + 1)
+  # A group ends where no earlier job reaches the first slot of the next.
+  splits = np.nonzero(first_slot[1:] >= np.maximum.accumulate(end_slot)[:-1])[0] + 1
+  return np.split(order, splits)
+
+
+# Expands rates given per cell between boundaries to fixed slots of
+# slot_length_sec starting at 0. Each slot gets the highest rate reached in it.
+def ExpandToSlots(boundaries, cell_rate, slot_length_sec=900.0):
+  first_slot = np.floor(boundaries[:-1] / slot_length_sec).astype(np.int64)
+  end_slot = np.ceil(boundaries[1:] / slot_length_sec).astype(np.int64)
+  cell, slot = _Ranges(first_slot, np.maximum(end_slot - first_slot, 1))
+  slot_rate = np.zeros(max(end_slot.max(), slot.max() + 1))
+  np.maximum.at(slot_rate, slot, cell_rate[cell])
+  return slot_rate
+
+
+# Returns the constraint matrix of lp as CSR arrays (indptr, indices, data).
+def CsrArrays(lp):
+  order = np.argsort(lp.row, kind='mergesort')
+  indptr = np.zeros(len(lp.row_lower) + 1, dtype=np.int64)
+  np.cumsum(np.bincount(lp.row, minlength=len(lp.row_lower)), out=indptr[1:])
+  return indptr, lp.col[order], lp.val[order]
+
+
+# Loads lp into OR-tools' model builder from the arrays in bulk and solves it
+# with the named solver. Returns None when this OR-tools or scipy lacks what
+# that needs, see _SolveWithMpSolver.
+def _SolveWithModelBuilder(lp, solver_name):
+  try:
+    from ortools.linear_solver.python import model_builder_helper
+    from scipy import sparse
+  except ImportError:
+    return None
+  with instrument.Span('lp_load'):
+    indptr, indices, data = CsrArrays(lp)
+    model = model_builder_helper.ModelBuilderHelper()
+    model.fill_model_from_sparse_data(lp.var_lower.astype(np.float64), lp.var_upper.astype(np.float64), lp.objective.astype(np.float64),
+                                      lp.row_lower.astype(np.float64), lp.row_upper.astype(np.float64),
+                                      sparse.csr_matrix((data.astype(np.float64), indices, indptr), shape=(len(lp.row_lower), lp.num_vars)))
+    solver = model_builder_helper.ModelSolverHelper(solver_name)
+  with instrument.Span('lp_solve'):
+    solver.solve(model)
+  if solver.status() not in (model_builder_helper.SolveStatus.OPTIMAL, model_builder_helper.SolveStatus.FEASIBLE):
+    raise RuntimeError('peak LP not solved: %s' % solver.status())
+  return np.array(solver.variable_values())
+
+
+# The same through an MPModelProto filled a row at a time, for OR-tools
+# without the model builder.
+def _SolveWithMpSolver(lp, solver_type):
+  from ortools.linear_solver import linear_solver_pb2
+  from ortools.linear_solver import pywraplp
+  with instrument.Span('lp_load'):
+    model = linear_solver_pb2.MPModelProto()
+    for lower, upper, cost in zip(lp.var_lower.tolist(), lp.var_upper.tolist(), lp.objective.tolist()):
+      model.variable.add(lower_bound=lower, upper_bound=upper, objective_coefficient=cost)
+    indptr, indices, data = CsrArrays(lp)
+    indptr = indptr.tolist()
+    for i, (lower, upper) in enumerate(zip(lp.row_lower.tolist(), lp.row_upper.tolist())):
+      constraint = model.constraint.add(lower_bound=lower, upper_bound=upper)
+      constraint.var_index.extend(indices[indptr[i]:indptr[i + 1]].tolist())
+      constraint.coefficient.extend(data[indptr[i]:indptr[i + 1]].tolist())
+    request = linear_solver_pb2.MPModelRequest(model=model, solver_type=solver_type)
+  response = linear_solver_pb2.MPSolutionResponse()
+  with instrument.Span('lp_solve'):
+    pywraplp.Solver.SolveWithProto(request, response)
+  if response.status not in (linear_solver_pb2.MPSOLVER_OPTIMAL, linear_solver_pb2.MPSOLVER_FEASIBLE):
+    raise RuntimeError('peak LP not solved: %s' % linear_solver_pb2.MPSolverResponseStatus.Name(response.status))
+  return np.array(response.variable_value)
+
+
+def SolveGlop(lp):
+  from ortools.linear_solver import linear_solver_pb2
+  x = _SolveWithModelBuilder(lp, 'glop')
+  return x if x is not None else _SolveWithMpSolver(lp, linear_solver_pb2.MPModelRequest.GLOP_LINEAR_PROGRAMMING)
+
+
+def SolvePdlp(lp):
+  from ortools.linear_solver import linear_solver_pb2
+  x = _SolveWithModelBuilder(lp, 'pdlp')
+  return x if x is not None else _SolveWithMpSolver(lp, linear_solver_pb2.MPModelRequest.PDLP_LINEAR_PROGRAMMING)
+
+
+def SolveHighs(lp):
+  from scipy import optimize
+  from scipy import sparse
+  with instrument.Span('lp_load'):
+    matrix = sparse.csr_matrix((lp.val, (lp.row, lp.col)), shape=(len(lp.row_lower), lp.num_vars))
+    slot_rows = slice(0, lp.num_slots)
+    demand_rows = slice(lp.num_slots, len(lp.row_lower))
+  with instrument.Span('lp_solve'):
+    result = optimize.linprog(lp.objective,
+                              A_ub=matrix[slot_rows], b_ub=lp.row_upper[slot_rows],
+                              A_eq=matrix[demand_rows], b_eq=lp.row_upper[demand_rows],
+                              bounds=np.column_stack([lp.var_lower, lp.var_upper]),
+                              method='highs')
+  if result.x is None:
+    raise RuntimeError('peak LP not solved: %s' % result.message)
+  return result.x
+
+
+SOLVERS = {
+    'glop': SolveGlop,
+    'highs': SolveHighs,
+    'pdlp': SolvePdlp,
+}
+
+
+# Solves lp with the named backend and returns the peak and the total
+# charging rate of every slot as an array.
+def SolvePeakLp(lp, solver='glop'):
+  x = SOLVERS[solver](lp)
+  with instrument.Span('lp_extract'):
+    total_rate = np.bincount(lp.cell_slot, weights=x[1:], minlength=lp.num_slots)
+  return x[0], total_rate
+
+
+_LpJob = recordtype('_LpJob', ['start_sec', 'end_sec', 'demand_kwh', 'max_charging_rate', 'constraint', 'first_slot', 'rate_vars', 'num_dead'])
+
+
+# The peak LP kept in a GLOP solver between solves. Update() diffs the given
+# jobs against the model by key: new jobs become new columns, a later start
+# retires the elapsed cells, a new demand moves the bounds of the job's demand
+# row and missing jobs are retired altogether. GLOP then restarts from the
+# previous basis. Slots are fixed to a grid starting at origin so that cells
+# stay put between updates; the result equals a fresh solve on that grid.
+class IncrementalPeakLp(object):
+
+  def __init__(self, origin, slot_length_sec=900.0):
+    self.origin = origin
+    self.slot_length_sec = slot_length_sec
+    self.num_updates = 0
+    self.num_rebuilds = 0
+    self.update_sec = 0.0
+    self.solve_sec = 0.0
+    self._Reset()
+
+  def _Reset(self):
+    from ortools.linear_solver import pywraplp
+    self.solver = pywraplp.Solver('IncrementalPeakLp', pywraplp.Solver.GLOP_LINEAR_PROGRAMMING)
+    self.peak = self.solver.NumVar(0, self.solver.infinity(), 'peak')
+    self.solver.Objective().SetCoefficient(self.peak, 1)
+    self.slot_constraints = {}
+    self.jobs = {}
+    self.num_vars = 0
+    self.num_dead_vars = 0
+
+  def _SlotConstraint(self, slot):
+    if slot not in self.slot_constraints:
+      constraint = self.solver.Constraint(-self.solver.infinity(), 0.0)
+      constraint.SetCoefficient(self.peak, -1)
+      self.slot_constraints[slot] = constraint
+    return self.slot_constraints[slot]
+
+  def _AddJob(self, job_id, start_sec, end_sec, demand_kwh, max_charging_rate):
+    first_slot = int(math.floor(start_sec / self.slot_length_sec))
+    end_slot = max(int(math.ceil(end_sec / self.slot_length_sec)), first_slot + 1)
+    max_demand = min(demand_kwh, (end_sec - start_sec) * max_charging_rate / 3600.0)
+    constraint = self.solver.Constraint(max_demand, max_demand)
+    rate_vars = []
+    for slot in range(first_slot, end_slot):
+      rate_var = self.solver.NumVar(0, max_charging_rate, '')
+      self._SlotConstraint(slot).SetCoefficient(rate_var, 1)
+      cell_sec = min(end_sec, (slot + 1) * self.slot_length_sec) - max(start_sec, slot * self.slot_length_sec)
+      constraint.SetCoefficient(rate_var, cell_sec / 3600.0)
+      rate_vars.append(rate_var)
+    self.num_vars += len(rate_vars)
+    self.jobs[job_id] = _LpJob(start_sec, end_sec, demand_kwh, max_charging_rate, constraint, first_slot, rate_vars, 0)
+
+  def _RetireVars(self, lp_job, num_dead):
+    for rate_var in lp_job.rate_vars[lp_job.num_dead:num_dead]:
+      rate_var.SetUb(0.0)
+      lp_job.constraint.SetCoefficient(rate_var, 0.0)
+    self.num_dead_vars += num_dead - lp_job.num_dead
+    lp_job.num_dead = num_dead
+
+  def _UpdateJob(self, lp_job, start_sec, demand_kwh):
+    if start_sec == lp_job.start_sec and demand_kwh == lp_job.demand_kwh:
+      return
+    if start_sec != lp_job.start_sec:
+      slot = int(math.floor(start_sec / self.slot_length_sec))
+      self._RetireVars(lp_job, min(slot - lp_job.first_slot, len(lp_job.rate_vars)))
+      if lp_job.num_dead < len(lp_job.rate_vars):
+        cell_sec = min(lp_job.end_sec, (slot + 1) * self.slot_length_sec) - start_sec
+        lp_job.constraint.SetCoefficient(lp_job.rate_vars[lp_job.num_dead], cell_sec / 3600.0)
+    lp_job.start_sec = start_sec
+    lp_job.demand_kwh = demand_kwh
+    max_demand = min(demand_kwh, max(lp_job.end_sec - start_sec, 0.0) * lp_job.max_charging_rate / 3600.0)
+    lp_job.constraint.SetBounds(max_demand, max_demand)
+
+  def _RemoveJob(self, job_id):
+    lp_job = self.jobs.pop(job_id)
+    self._RetireVars(lp_job, len(lp_job.rate_vars))
+    lp_job.constraint.SetBounds(0.0, 0.0)
+
+  # Starts over with a fresh solver once most columns are retired.
+  def _Rebuild(self):
+    jobs = self.jobs
+    self._Reset()
+    for job_id, lp_job in jobs.items():
+      self._AddJob(job_id, lp_job.start_sec, lp_job.end_sec, lp_job.demand_kwh, lp_job.max_charging_rate)
+    self.num_rebuilds += 1
+
+  # Sets the jobs of the model. job_keys identify the jobs across updates,
+  # the other arguments are as for BuildPeakLp but in seconds from origin.
+  def Update(self, job_keys, start_sec, end_sec, demand_kwh, max_charging_rate):
+    with instrument.Span('lp_update'):
+      self._Update(job_keys, start_sec, end_sec, demand_kwh, max_charging_rate)
+    instrument.Count('lp_cols', self.num_vars - self.num_dead_vars + 1)
+
+  def _Update(self, job_keys, start_sec, end_sec, demand_kwh, max_charging_rate):
+    start = time.time()
+    job_ids = set(job_keys)
+    for (job_id, job_start_sec, job_end_sec, job_demand_kwh, job_max_charging_rate) in zip(
+        job_keys, np.asarray(start_sec).tolist(), np.asarray(end_sec).tolist(), np.asarray(demand_kwh).tolist(),
+        np.asarray(max_charging_rate).tolist()):
+      lp_job = self.jobs.get(job_id)
+      if lp_job is not None and job_start_sec < lp_job.start_sec:
+        # Cells are only ever retired from the front, an earlier start needs
+        # the job to be added again.
+        self._RemoveJob(job_id)
+        lp_job = None
+      if lp_job is None:
+        self._AddJob(job_id, job_start_sec, job_end_sec, job_demand_kwh, job_max_charging_rate)
+      else:
+        self._UpdateJob(lp_job, job_start_sec, job_demand_kwh)
+    for job_id in [job_id for job_id in self.jobs if job_id not in job_ids]:
+      self._RemoveJob(job_id)
+    if self.num_dead_vars > max(self.num_vars - self.num_dead_vars, 1000):
+      self._Rebuild()
+    self.num_updates += 1
+    self.update_sec += time.time() - start
+
+  # Returns the optimal peak of the jobs given to the last Update().
+  def Solve(self):
+    start = time.time()
+    with instrument.Span('lp_solve'):
+      self.solver.Solve()
+    self.solve_sec += time.time() - start
+    return self.peak.solution_value()
+
+
+# The peak LP of a growing set of jobs over a horizon that only moves forward.
+# Advance() freezes the slots that have passed at the rates of the last
+# solve: their highest total is kept as a lower bound on the peak, the energy
+# they gave each job comes off its demand and jobs that have left are
+# dropped. Solve() then models only the slots from the frozen boundary on, so
+# the model is as large as the set of jobs present or announced, however long
+# the run. As the frozen rates came from earlier solves over fewer jobs, the
+# peak can be above the optimum over all jobs at once.
+class RollingPeakLp(object):
+
+  def __init__(self, origin, slot_length_sec=900.0, solver='glop'):
+    self.origin = origin
+    self.slot_length_sec = slot_length_sec
+    self.solver = solver
+    self.frozen_slots = 0
+    self.frozen_peak = 0.0
+    self.start_sec = np.zeros(0)
+    self.end_sec = np.zeros(0)
+    self.demand_kwh = np.zeros(0)
+    self.max_charging_rate = np.zeros(0)
+    self.pending = []
+    # The cells of the last solve: job, slot from origin, hours and rate.
+    self.cell_job = np.zeros(0, dtype=np.int64)
+    self.cell_slot = np.zeros(0, dtype=np.int64)
+    self.cell_hours = np.zeros(0)
+    self.cell_rate = np.zeros(0)
+    self.num_vars = 0
+
+  # Adds a job, times in seconds from origin. It must not start in a frozen
+  # slot.
+  def Add(self, start_sec, end_sec, demand_kwh, max_charging_rate):
+    assert start_sec >= self.frozen_slots * self.slot_length_sec
+    self.pending.append((start_sec, end_sec, min(demand_kwh, (end_sec - start_sec) * max_charging_rate / 3600.0), max_charging_rate))
+
+  def _AddPending(self):
+    if self.pending:
+      (start_sec, end_sec, demand_kwh, max_charging_rate) = [np.array(column, dtype=float) for column in zip(*self.pending)]
+      self.start_sec = np.concatenate([self.start_sec, start_sec])
+      self.end_sec = np.concatenate([self.end_sec, end_sec])
+      self.demand_kwh = np.concatenate([self.demand_kwh, demand_kwh])
+      self.max_charging_rate = np.concatenate([self.max_charging_rate, max_charging_rate])
+      self.pending = []
+
+  # Freezes the slots that end by now_sec seconds from origin.
+  def Advance(self, now_sec):
+    frozen_slots = int(math.floor(now_sec / self.slot_length_sec))
+    if frozen_slots <= self.frozen_slots:
+      return
+    with instrument.Span('lp_advance'):
+      self._Freeze(frozen_slots)
+
+  def _Freeze(self, frozen_slots):
+    self._AddPending()
+    past = self.cell_slot < frozen_slots
+    if past.any():
+      slot_total = np.bincount(self.cell_slot[past] - self.frozen_slots, weights=self.cell_rate[past])
+      self.frozen_peak = max(self.frozen_peak, float(slot_total.max()))
+      delivered = np.bincount(self.cell_job[past], weights=self.cell_rate[past] * self.cell_hours[past], minlength=len(self.demand_kwh))
+      self.demand_kwh = np.maximum(self.demand_kwh - delivered, 0.0)
+    boundary = frozen_slots * self.slot_length_sec
+    keep = self.end_sec > boundary
+    new_index = np.cumsum(keep) - 1
+    future = ~past
+    self.cell_job = new_index[self.cell_job[future]]
+    self.cell_slot = self.cell_slot[future]
+    self.cell_hours = self.cell_hours[future]
+    self.cell_rate = self.cell_rate[future]
+    self.start_sec = np.maximum(self.start_sec[keep], boundary)
+    self.end_sec = self.end_sec[keep]
+    self.demand_kwh = self.demand_kwh[keep]
+    self.max_charging_rate = self.max_charging_rate[keep]
+    self.frozen_slots = frozen_slots
+
+  # Returns the peak over the frozen slots and an optimal schedule of the
+  # rest.
+  def Solve(self):
+    self._AddPending()
+    if len(self.demand_kwh) == 0:
+      return self.frozen_peak
+    base = self.frozen_slots * self.slot_length_sec
+    lp = BuildPeakLp(self.start_sec - base, self.end_sec - base, self.demand_kwh, self.max_charging_rate, self.slot_length_sec)
+    x = SOLVERS[self.solver](lp)
+    self.num_vars = lp.num_vars
+    self.cell_job = lp.cell_job
+    self.cell_slot = lp.cell_slot + self.frozen_slots
+    self.cell_hours = lp.val[-len(lp.cell_job):]
+    self.cell_rate = x[1:]
+    return max(self.frozen_peak, x[0])
@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+import asyncio
+import datetime
+import json
+import time
+
+import ev
+import numpy as np
+import service
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_float('speedup', 3600.0, 'seconds of the trace to replay per second')
+flags.DEFINE_float('replay_days', 7.0, 'days of the Caltech ACN period to replay')
+flags.DEFINE_string('replay_output', '', 'file to also write the latencies to as JSON')
+
+# Streams the sessions of the Caltech ACN period to service.py, --speedup
+# times faster than they happened, and reports the end-to-end decision latency
+# of every event: from sending it to reading the setpoint back. Reserved
+# sessions are sent as a reserve event at their reservation time and a plugin
+# at their start, the others as a plugin at their start; every session ends
+# with an unplug. --prob and --reserve_lead_hours pick the reservations and
+# --host, --port and --socket the service, as for ev.py and service.py.
+# Python 3 only.
+
+def _Events(records):
+  events = []
+  for record in records:
+    max_charging_rate = record.energy_charged_kwh / ev.ToHours(record.done_charging - record.start_time)
+    session = {'id': record.id, 'start': ev.ToEpochSeconds(record.start_time), 'end': ev.ToEpochSeconds(record.end_time),
+               'energy_kwh': record.energy_charged_kwh, 'max_rate_kw': max_charging_rate}
+    if record.reserve_time < record.start_time:
+      events.append(dict(session, event='reserve', time=ev.ToEpochSeconds(record.reserve_time)))
+    events.append(dict(session, event='plugin', time=session['start']))
+    events.append({'event': 'unplug', 'id': record.id, 'time': session['end']})
+  events.sort(key=lambda event : event['time'])
+  for seq, event in enumerate(events):
+    event['seq'] = seq
+  return events
+
+async def _Replay(events):
+  if FLAGS.socket:
+    (reader, writer) = await asyncio.open_unix_connection(FLAGS.socket)
+  else:
+    (reader, writer) = await asyncio.open_connection(FLAGS.host, FLAGS.port)
+  sent = {}
+  replies = {}
+
+  async def Read():
+    while len(replies) < len(events):
+      line = await reader.readline()
+      if not line:
+        break
+      reply = json.loads(line.decode('utf-8'))
+      reply['latency_ms'] = (time.time() - sent[reply['seq']]) * 1000.0
+      replies[reply['seq']] = reply
+
+  reading = asyncio.ensure_future(Read())
+  wall_start = time.time()
+  trace_start = events[0]['time']
+  for event in events:
+    delay = wall_start + (event['time'] - trace_start) / FLAGS.speedup - time.time()
+    if delay > 0:
+      await asyncio.sleep(delay)
+    sent[event['seq']] = time.time()
+    writer.write((json.dumps(event) + '\n').encode('utf-8'))
+    await writer.drain()
+  await reading
+  writer.close()
+  return [replies[seq] for seq in sorted(replies)], time.time() - wall_start
+
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0)]
+  time_period.append(time_period[0] + datetime.timedelta(days=FLAGS.replay_days))
+  events = _Events(ev.LoadData(time_period[0], time_period[1]))
+  (replies, seconds) = asyncio.run(_Replay(events))
+  errors = [reply for reply in replies if 'error' in reply]
+  latency_ms = np.array([reply['latency_ms'] for reply in replies if 'error' not in reply])
+  solve_ms = np.array([reply['solve_ms'] for reply in replies if 'error' not in reply])
+  print('events: %d replies: %d errors: %d seconds: %.1f ticks: %d over budget: %d' % (
+      len(events), len(replies), len(errors), seconds, len(set(reply['time'] for reply in replies if 'error' not in reply)),
+      sum(reply.get('over_budget', False) for reply in replies)))
+  for (name, values) in [('end-to-end', latency_ms), ('solve', solve_ms)]:
+    if len(values):
+      print('%s ms p50/p95/p99/max: %.2f/%.2f/%.2f/%.2f' % (name, np.percentile(values, 50), np.percentile(values, 95),
+                                                            np.percentile(values, 99), values.max()))
+  for reply in errors[:5]:
+    print('error:', reply)
+  if FLAGS.replay_output:
+    with open(FLAGS.replay_output, 'w') as f:
+      json.dump(replies, f)
+
+
+if __name__ == '__main__':
+  app.run(main)
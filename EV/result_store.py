@@ -0,0 +1,94 @@
+import atomic_file
+import collections
+import hashlib
+import json
+import os
+import sys
+
+import results
+
+# Content-addressed store of per-day scheduler results, so that a sweep can
+# skip what an earlier run, or a concurrent one, already computed.
+#
+# A result is one results.COLUMNS row, keyed by the SHA-256 of the scheduler,
+# its setting (scale, prob, reserve lead hours, schedule slot minutes), the
+# day, the code version and the scheduler settings that are not part of the
+# setting, such as the LP solver and slot length. The code version is by
+# default CodeVersion(), a hash of the modules the running script has loaded
+# from this directory, so that changing any of them starts the store afresh.
+#
+# Results are kept in a dict, and with store_dir also written there as one
+# JSON file each, through atomic_file so that a crash or a concurrent writer
+# never leaves a partial file. Two processes writing the same key write the
+# same row, so whichever rename comes last is as good as the other.
+
+# Returns the SHA-256 of the source of every module of this directory loaded
+# in this process, the script itself included. Call it once the script's
+# imports are done.
+def CodeVersion():
+  directory = os.path.dirname(os.path.abspath(__file__))
+  paths = set()
+  for module in list(sys.modules.values()):
+    path = getattr(module, '__file__', None)
+    if path and os.path.dirname(os.path.abspath(path)) == directory:
+      paths.add(os.path.splitext(os.path.abspath(path))[0] + '.py')
+  digest = hashlib.sha256()
+  for path in sorted(paths):
+    digest.update(os.path.basename(path).encode('utf-8'))
+    with open(path, 'rb') as f:
+      digest.update(f.read())
+  return digest.hexdigest()
+
+
+class ResultStore(object):
+
+  def __init__(self, store_dir=None, code_version=None):
+    self.store_dir = store_dir
+    self.code_version = code_version or CodeVersion()
+    self.rows = {}
+    self.stats = collections.Counter()
+    if store_dir and not os.path.isdir(store_dir):
+      try:
+        os.makedirs(store_dir)
+      except OSError:
+        # Another process created it first.
+        pass
+
+  # Returns the key of the result of scheduler on day with setting and the
+  # ev.SimConfig config. The offline optimum does not depend on the setting,
+  # so pass None for it.
+  def Key(self, scheduler, setting, day, config):
+    if setting is not None:
+      setting = [float(value) for value in setting]
+    config = [config.lp_solver, config.incremental_lp, float(config.lp_slot_sec), config.event_grid, config.continuous,
+              config.rolling_horizon]
+    return hashlib.sha256(json.dumps([scheduler, setting, day, config, self.code_version]).encode('utf-8')).hexdigest()
+
+  def _Path(self, key):
+    return os.path.join(self.store_dir, key[:2], key + '.json')
+
+  # Returns the row of key, a tuple in the order of results.COLUMNS, or None.
+  def Get(self, key):
+    if key in self.rows:
+      return self.rows[key]
+    if self.store_dir:
+      try:
+        with open(self._Path(key)) as f:
+          stored = json.load(f)
+      except (IOError, OSError, ValueError):
+        stored = None
+      if stored is not None:
+        self.stats['hits'] += 1
+        self.rows[key] = tuple(stored[name] for name in results.COLUMNS)
+        return self.rows[key]
+    self.stats['misses'] += 1
+    return None
+
+  def Put(self, key, row):
+    self.rows[key] = tuple(row)
+    if self.store_dir:
+      path = self._Path(key)
+      if os.path.exists(path):
+        return
+      atomic_file.AtomicWrite(path, lambda f : json.dump(collections.OrderedDict(zip(results.COLUMNS, row)), f))
+      self.stats['writes'] += 1
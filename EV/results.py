@@ -0,0 +1,55 @@
+import atomic_file
+import collections
+import csv
+
+import numpy as np
+
+# Per-day, per-scheduler result tables.
+#
+# A table has one row per (day, setting, scheduler) with the COLUMNS below and
+# is written either as CSV or, for a path ending in .npz, as one NumPy array
+# per column. Load() reads both back as a dict of column arrays, so analysis
+# never has to parse the printed summaries.
+
+COLUMNS = ['day', 'scale', 'prob', 'reserve_lead_hours', 'schedule_slot_min', 'scheduler', 'unfinished_ratio', 'peak', 'energy_kwh',
+           'run_time_sec', 'optimal_peak']
+STRING_COLUMNS = ['day', 'scheduler']
+
+
+def Format(value):
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Returns the rows for the summaries of one day, with the setting as
+# (scale, prob, reserve lead hours, schedule slot minutes).
+def Rows(day, setting, summaries, optimal_peak):
+  return [(day,) + tuple(setting) + tuple(summary) + (optimal_peak,) for summary in summaries]
+
+# Writes rows, tuples in the order of COLUMNS, to path, through atomic_file
+# so that it is either complete or absent.
+def Write(path, rows):
+  if path.endswith('.npz'):
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    arrays = {}
+    for name, values in zip(COLUMNS, columns):
+      arrays[name] = np.array(values, dtype=np.str_ if name in STRING_COLUMNS else np.float64)
+    atomic_file.AtomicWrite(path, lambda f : np.savez(f, **arrays), 'wb')
+  else:
+    def WriteCsv(f):
+      f.write(','.join(COLUMNS) + '\n')
+      for row in rows:
+        f.write(','.join(Format(value) for value in row) + '\n')
+    atomic_file.AtomicWrite(path, WriteCsv)
+
+# Returns the table in path as an OrderedDict of column name to array.
+def Load(path):
+  if path.endswith('.npz'):
+    with np.load(path) as npz:
+      return collections.OrderedDict((name, npz[name]) for name in COLUMNS)
+  with open(path) as f:
+    reader = csv.reader(f)
+    header = next(reader)
+    columns = list(zip(*reader)) or [()] * len(header)
+  table = collections.OrderedDict()
+  for name, values in zip(header, columns):
+    table[name] = np.array(values, dtype=np.str_ if name in STRING_COLUMNS else np.float64)
+  return table
@@ -1,6 +1,3 @@
 #!/bin/bash
-for ratio in 1.0 1.05 1.1 1.15 1.2 1.25 1.3;
-do
-	echo "Running: "$ratio
-	python ev.py --scale=$ratio > reserve_0.5_3h/scale=$ratio
-done
+python sweep.py --scales=1.0,1.05,1.1,1.15,1.2,1.25,1.3 --probs=0.5 --reserve_leads=3 --output=reserve_0.5_3h.csv --store=sweep_store "$@"
+python analysis.py --results=reserve_0.5_3h.csv
@@ -1,112 +1,138 @@
+from __future__ import print_function
+
+import collections
 import datetime
-import numpy as np
-import math
+import heapq
+import history
+import instrument
+import job_table
 import matplotlib.pyplot as plt
+import numpy as np
+import peak_flow
+import peak_lp
 import recordtype
-import sys
+import time
 
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 from datetime import timedelta
-from ortools.linear_solver import pywraplp
 from recordtype import recordtype
 
 EvJob = recordtype('EvJob', ['id', 'notify_time', 'start_time','end_time', 'demand_kwh', 'max_charging_rate'])
 
-# Given a list of ev jobs, computes the offline optimal peak
-def ComputeOptimalPeak(ev_jobs):
-  time_horizon_start = datetime.max
-  time_horizon_end = datetime.min
-  for ev_job in ev_jobs:
-    if ev_job.start_time < time_horizon_start:
-      time_horizon_start = ev_job.start_time
-    if ev_job.end_time > time_horizon_end:
-      time_horizon_end = ev_job.end_time
-  # The length of each slot is 900 seconds.
-  slot_length_sec = 900.0
-  num_slots = math.ceil((time_horizon_end - time_horizon_start).total_seconds() / slot_length_sec)
-  solver = pywraplp.Solver('SolveSimpleSystem', pywraplp.Solver.GLOP_LINEAR_PROGRAMMING)
-  peak = solver.NumVar(0, solver.infinity(), 'peak')
-  peak_constraints = []
-  for i in range(int(num_slots)):
-    constraint = solver.Constraint(-solver.infinity(), 0.0)
-    constraint.SetCoefficient(peak, -1)
-    peak_constraints.append(constraint)
-  charging_rate_vars = {i:[] for i in range(int(num_slots))}
-  # print("*****")
-  for ev_job in ev_jobs:
-    start_sec = (ev_job.start_time - time_horizon_start).total_seconds()
-    end_sec = (ev_job.end_time - time_horizon_start).total_seconds()
-    start_index = int(math.floor(start_sec / slot_length_sec))
-    time_after_start_sec = (start_index + 1) * slot_length_sec
-    times = [start_sec]
-    while time_after_start_sec < end_sec:
-      times.append(time_after_start_sec)
-      time_after_start_sec += slot_length_sec
-    times.append(end_sec)
-    max_demand = min(ev_job.demand_kwh, (ev_job.end_time - ev_job.start_time).total_seconds() * ev_job.max_charging_rate / 3600)
-    # if max_demand < ev_job.demand_kwh:
-      # print("Warning: job ", ev_job.id, " cannot be fully charged before deadline")
-    charging_constraint = solver.Constraint(max_demand, max_demand)
-    for i in range(len(times) - 1):
-      charging_rate_var_name = str(ev_job.id + 'charging_rate' + str(i))
-      charging_rate_vars[i + start_index].append(solver.NumVar(0, ev_job.max_charging_rate, charging_rate_var_name))
-      size = len(charging_rate_vars[i + start_index])
-      charging_constraint.SetCoefficient(charging_rate_vars[i + start_index][size - 1], (times[i+1] - times[i]) / 3600.0)
-      peak_constraints[i + start_index].SetCoefficient(charging_rate_vars[i + start_index][size - 1], 1)
-  objective = solver.Objective()
-  objective.SetCoefficient(peak, 1)
-  solver.Solve()
-  total_rate = {}
-  for i in range(int(num_slots)):
-    total_rate[time_horizon_start + timedelta(seconds = i * slot_length_sec)] = sum([var.solution_value() for var in charging_rate_vars[i]])
-  return peak.solution_value(), total_rate
+# What a scheduler did over a run: the fraction of its jobs left unfinished,
+# its peak total rate, the energy it delivered up to its last recorded rate
+# and the wall time its Schedule() calls took, as counted by TimedSchedule().
+SchedulerSummary = collections.namedtuple('SchedulerSummary', ['name', 'unfinished_ratio', 'peak', 'energy_kwh', 'run_time_sec'])
+
+# Given a list of ev jobs, computes the offline optimal peak. solver is one of
+# the LP backends in peak_lp.SOLVERS or 'flow' for the exact max-flow solver.
+# Rates are held constant over slots of slot_length_sec, or with event_grid
+# (always for 'flow') only between consecutive job start and end instants,
+# which gives a much smaller model and the exact optimum. Either way
+# total_rate is returned per slot of slot_length_sec. With a
+# peak_cache.PeakCache, solves of the same jobs are only done once.
+def ComputeOptimalPeak(ev_jobs, solver='glop', slot_length_sec=900.0, event_grid=False, cache=None):
+  if len(ev_jobs) == 0:
+    return 0.0, {}
+  return ComputeOptimalPeakOfArrays(peak_lp.JobArrays(ev_jobs), solver, slot_length_sec, event_grid, cache)
+
+# As ComputeOptimalPeak, for jobs given as peak_lp.JobArrays returns them.
+def ComputeOptimalPeakOfArrays(job_arrays, solver='glop', slot_length_sec=900.0, event_grid=False, cache=None):
+  horizon_start, start_sec, end_sec, demand_kwh, max_charging_rate = job_arrays
+  instrument.Count('peak_jobs', len(start_sec))
+  with instrument.Span('ComputeOptimalPeak'):
+    if cache is None:
+      peak, slot_rates = _SolveOptimalPeak(start_sec, end_sec, demand_kwh, max_charging_rate, solver, slot_length_sec, event_grid)
+    else:
+      key = cache.Key(start_sec, end_sec, demand_kwh, max_charging_rate, slot_length_sec, solver, event_grid)
+      value = cache.Get(key)
+      if value is None:
+        value = _SolveOptimalPeak(start_sec, end_sec, demand_kwh, max_charging_rate, solver, slot_length_sec, event_grid)
+        cache.Put(key, *value)
+      peak, slot_rates = value
+    total_rate = {}
+    for i, rate in enumerate(slot_rates.tolist()):
+      total_rate[horizon_start + timedelta(seconds = i * slot_length_sec)] = rate
+  return peak, total_rate
+
+# Returns the peak and the total rate per slot for the jobs' arrays.
+def _SolveOptimalPeak(start_sec, end_sec, demand_kwh, max_charging_rate, solver, slot_length_sec, event_grid):
+  if solver == 'flow':
+    with instrument.Span('flow_solve'):
+      peak, boundaries, cell_rates = peak_flow.SolvePeakFlow(start_sec, end_sec, demand_kwh, max_charging_rate)
+    with instrument.Span('lp_extract'):
+      slot_rates = peak_lp.ExpandToSlots(boundaries, cell_rates, slot_length_sec)
+  elif event_grid:
+    boundaries = peak_lp.EventGrid(start_sec, end_sec)
+    lp = peak_lp.BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate, boundaries=boundaries)
+    peak, cell_rates = peak_lp.SolvePeakLp(lp, solver)
+    with instrument.Span('lp_extract'):
+      slot_rates = peak_lp.ExpandToSlots(boundaries, cell_rates, slot_length_sec)
+  else:
+    lp = peak_lp.BuildPeakLp(start_sec, end_sec, demand_kwh, max_charging_rate, slot_length_sec)
+    peak, slot_rates = peak_lp.SolvePeakLp(lp, solver)
+  return peak, slot_rates
 
 
 class Scheduler:
   __metaclass__ = ABCMeta
 
-  def __init__(self):
-    self.all_jobs = []
-    self.original_jobs = []
-    self.schedule_history = {}
+  # Without history_detail only the total rates are recorded, not the rate of
+  # every job.
+  def __init__(self, history_detail=True):
+    self.jobs = job_table.JobTable()
+    self.schedule_history = history.ScheduleHistory(history_detail)
     self.num_unfinished_job = 0
     self.num_job = 0
+    self.run_time_sec = 0.0
 
   def AddEvJob(self, job_id, notify_time, arrival_time, end_time, demand, max_charging_rate):
     assert notify_time >= self.current_time
     self.num_job += 1
     self.current_time = notify_time
-    self.all_jobs.append(EvJob(job_id, notify_time, arrival_time, end_time, demand, max_charging_rate))
-    self.original_jobs.append(EvJob(job_id, notify_time, arrival_time, end_time, demand, max_charging_rate))
+    self.jobs.Add(job_id, notify_time, arrival_time, end_time, demand, max_charging_rate)
+
+  # Takes finished jobs out of the active set. Their rows are reused unless
+  # the scheduler still needs the jobs as they were added.
+  def RetireJobs(self, handles):
+    self.jobs.Free(handles)
 
   @abstractmethod
   def Schedule(self, schedule_time):
     pass
 
-  def TotalChargingRate(self, schedule_time):
-    total = 0.0
-    for job_id in self.schedule_history[schedule_time]:
-      total += self.schedule_history[schedule_time][job_id]
-    return total
-
   @abstractmethod
   def Name(self):
     pass
 
+  # Schedule(), with its wall time added to run_time_sec. Instrumented, as
+  # a span of the scheduler's own with a count of its active jobs.
+  def TimedSchedule(self, schedule_time):
+    start = time.time()
+    with instrument.Span('Schedule', scheduler=self.Name()):
+      instrument.Count('active_jobs', len(self.jobs.Active()))
+      self.Schedule(schedule_time)
+    self.run_time_sec += time.time() - start
+
+  # Returns the SchedulerSummary of the run so far. Unlike the scheduler
+  # itself it can be pickled.
+  def Summary(self):
+    return SchedulerSummary(self.Name(), float(self.num_unfinished_job)/self.num_job, self.schedule_history.peak,
+                            self.schedule_history.energy_kwh, self.run_time_sec)
+
+  @staticmethod
+  def PrintSummary(summary):
+    print(summary.name, "'s finish ratio: ", summary.unfinished_ratio, " peak: ", summary.peak)
+
   @staticmethod
   def Plot(schedulers, time_period, show):
     if show:
       plt.figure()
     for scheduler in schedulers:
-      times = []
-      total_charging_rate = []
-      for schedule_time in scheduler.schedule_history:
-        times.append(schedule_time)
-        total_charging_rate.append(scheduler.TotalChargingRate(schedule_time))
       if show:
-        plt.scatter(times, total_charging_rate, label=scheduler.Name())
-      print scheduler.Name(), "'s finish ratio: ", float(scheduler.num_unfinished_job)/scheduler.num_job, " peak: ", max(total_charging_rate)
+        plt.scatter(scheduler.schedule_history.Times().tolist(), scheduler.schedule_history.TotalRates(), label=scheduler.Name())
+      Scheduler.PrintSummary(scheduler.Summary())
     
     if show:
       plt.xlim(time_period)
@@ -114,209 +140,312 @@ class Scheduler:
       plt.show()
 
 
-class MaxRateScheduler(Scheduler):
+# Base of the schedulers that set a rate for every job whenever a job is
+# added. Schedule() charges the rates set last time up to schedule_time,
+# retires the jobs left with at most finished_kwh and sets new rates with
+# Rates(), all as array operations over the active jobs.
+class ContinuousScheduler(Scheduler):
+
+  finished_kwh = 0.0
 
-  def __init__(self):
-    Scheduler.__init__(self)
+  def __init__(self, history_detail=True):
+    Scheduler.__init__(self, history_detail)
     self.current_time = datetime.min
-    self.last_schedule = {}
     self.last_schedule_time = datetime.min
+    # Jobs added before the last Schedule() have a smaller sequence number.
+    self.last_seq = 0
+
+  @abstractmethod
+  def Rates(self, handles, schedule_time):
+    pass
 
   def Schedule(self, schedule_time):
     assert schedule_time >= self.last_schedule_time
-    num_jobs = len(self.all_jobs)
-    for idx in range(num_jobs - 1, -1, -1):
-      job_id = self.all_jobs[idx].id
-      if self.last_schedule.has_key(job_id):
-        charged_kwh = self.last_schedule[job_id] * (schedule_time - self.last_schedule_time).total_seconds() / 3600.0
-        self.all_jobs[idx].demand_kwh -= charged_kwh
-	if self.all_jobs[idx].demand_kwh <= 0:
-	  self.all_jobs.pop(idx)
-    self.last_schedule.clear()
-    # print ("**********")
-    for job in self.all_jobs:
-      self.last_schedule[job.id] = job.max_charging_rate
-      # print(self.Name(), schedule_time, job.id, self.last_schedule[job.id])
-    self.schedule_history[schedule_time] = self.last_schedule.copy()
+    jobs = self.jobs
+    handles = jobs.Active()
+    charged = handles[jobs.seq[handles] < self.last_seq]
+    jobs.demand[charged] -= jobs.rate[charged] * (schedule_time - self.last_schedule_time).total_seconds() / 3600.0
+    self.RetireJobs(charged[jobs.demand[charged] <= self.finished_kwh])
+    handles = handles[jobs.active[handles]]
+    jobs.rate[handles] = self.Rates(handles, schedule_time)
+    rates = jobs.rate[handles]
+    job_ids = jobs.Ids(handles) if self.schedule_history.detail else ()
+    self.schedule_history.Record(schedule_time, sum(rates.tolist(), 0.0), job_ids, rates)
+    self.last_seq = jobs.next_seq
     self.last_schedule_time = schedule_time
 
+
+class MaxRateScheduler(ContinuousScheduler):
+
+  def Rates(self, handles, schedule_time):
+    return self.jobs.max_rate[handles]
+
   def Name(self):
     return "Max scheduler"
 
 
-class FixRateScheduler(Scheduler):
+class FixRateScheduler(ContinuousScheduler):
 
-  def __init__(self):
-    Scheduler.__init__(self)
-    self.current_time = datetime.min
-    self.last_schedule = {}
-    self.last_schedule_time = datetime.min
+  finished_kwh = 1e-4
 
-  def Schedule(self, schedule_time):
-    assert schedule_time >= self.last_schedule_time
-    num_jobs = len(self.all_jobs)
-    for idx in range(num_jobs - 1, -1, -1):
-      job_id = self.all_jobs[idx].id
-      if self.last_schedule.has_key(job_id):
-        charged_kwh = self.last_schedule[job_id] * (schedule_time - self.last_schedule_time).total_seconds() / 3600.0
-        self.all_jobs[idx].demand_kwh -= charged_kwh
-	if self.all_jobs[idx].demand_kwh <= 1e-4:
-	  self.all_jobs.pop(idx)
-    self.last_schedule.clear()
-    # print ("**********")
-    for job in self.all_jobs:
-      assert job.end_time > schedule_time
-      self.last_schedule[job.id] = job.demand_kwh / (job.end_time - schedule_time).total_seconds() * 3600.0
-      # print(self.Name(), schedule_time, job.id, self.last_schedule[job.id])
-    self.schedule_history[schedule_time] = self.last_schedule.copy()
-    self.last_schedule_time = schedule_time
+  def Rates(self, handles, schedule_time):
+    remaining_sec = (self.jobs.end[handles] - np.datetime64(schedule_time, 'us')).astype(np.int64) / 1e6
+    assert (remaining_sec > 0).all()
+    return self.jobs.demand[handles] / remaining_sec * 3600.0
 
   def Name(self):
     return "Fix rate scheduler"
 
 class OracleScheduler(Scheduler):
 
-  def __init__(self):
-    Scheduler.__init__(self)
+  # With split_components the jobs are solved in groups that share no slot
+  # (peak_lp.SlotComponents), which gives the same result; for runs that are
+  # not cut into days.
+  def __init__(self, lp_solver='glop', slot_length_sec=900.0, event_grid=False, peak_cache=None, split_components=False):
+    Scheduler.__init__(self, False)
     self.current_time = datetime.min
+    self.lp_solver = lp_solver
+    self.slot_length_sec = slot_length_sec
+    self.event_grid = event_grid
+    self.peak_cache = peak_cache
+    self.split_components = split_components
 
   def Schedule(self, schedule_time):
-    num_jobs = len(self.all_jobs)
-    jobs = [job for job in self.all_jobs if job.start_time <= schedule_time]
-    (peak, schedule) = ComputeOptimalPeak(jobs)
-    # print("Oracle", peak, schedule_time)
-    self.schedule_history.update(schedule)
+    handles = self.jobs.Active()
+    handles = handles[self.jobs.start[handles] <= np.datetime64(schedule_time, 'us')]
+    if len(handles) == 0:
+      return
+    self.schedule_history.Clear()
+    if not self.split_components:
+      (peak, schedule) = ComputeOptimalPeakOfArrays(self.jobs.Arrays(handles), self.lp_solver, self.slot_length_sec, self.event_grid,
+                                                    self.peak_cache)
+      for slot_time in sorted(schedule):
+        self.schedule_history.Record(slot_time, schedule[slot_time])
+      return
+    (horizon_start, start_sec, end_sec, demand_kwh, max_charging_rate) = self.jobs.Arrays(handles)
+    for component in peak_lp.SlotComponents(start_sec, end_sec, self.slot_length_sec):
+      # Shift by whole slots to keep the slots of the whole.
+      offset = np.floor(start_sec[component].min() / self.slot_length_sec) * self.slot_length_sec
+      (peak, schedule) = ComputeOptimalPeakOfArrays(
+          (horizon_start + timedelta(seconds=offset), start_sec[component] - offset, end_sec[component] - offset, demand_kwh[component],
+           max_charging_rate[component]), self.lp_solver, self.slot_length_sec, self.event_grid, self.peak_cache)
+      for slot_time in sorted(schedule):
+        self.schedule_history.Record(slot_time, schedule[slot_time])
+      # Nothing charges until the next group.
+      self.schedule_history.Record(max(schedule) + timedelta(seconds=self.slot_length_sec), 0.0)
 
   def Name(self):
     return "Offline optimal scheduler"
 
-  def TotalChargingRate(self, schedule_time):
-    return self.schedule_history[schedule_time]
-
 class GreedyScheduler(Scheduler):
 
-  def __init__(self, scale_factor=1.0):
-    Scheduler.__init__(self)
+  def __init__(self, scale_factor=1.0, lp_solver='glop', incremental_lp=False, slot_length_sec=900.0, event_grid=False, peak_cache=None):
+    Scheduler.__init__(self, False)
     self.current_time = datetime.min
     self.last_schedule_time = datetime.min
-    self.peak_history = {}
     self.scale_factor = scale_factor
-
-  def GetJobBatch(self, ev_jobs, job_to_progress_deadline):
+    self.lp_solver = lp_solver
+    self.slot_length_sec = slot_length_sec
+    self.event_grid = event_grid
+    self.peak_cache = peak_cache
+    # With incremental_lp the peak LP of the jobs as added is kept in GLOP
+    # between Schedule calls over fixed slots, and lp_solver, event_grid and
+    # peak_cache are ignored for it. Only EpsScheduler solves that peak: the
+    # peak GreedyScheduler solves is over jobs whose start moves to every
+    # tick, so a model on fixed slots would change its result and save
+    # nothing, and it is always solved afresh.
+    self.incremental_lp = incremental_lp
+    self.incremental_peak_lp = None
+    self.num_peak_solves = 0
+    self.peak_time_sec = 0.0
+
+  # Pops the positions of the jobs with the earliest progress deadline from
+  # queue, all those within a second of the first one. Jobs that have left or
+  # finished by start are dropped on the way.
+  def PopJobBatch(self, queue, start, end_time, demand):
     job_batch = []
-    cur_progress_deadline = datetime.min
-    remaining_jobs = [job for job in ev_jobs if job.demand_kwh > 1e-4]
-    for job in remaining_jobs:
-      # print(job.start_time, job.end_time, job.demand_kwh)
-      if job_to_progress_deadline[job] > cur_progress_deadline + timedelta(seconds=1):
-        if len(job_batch) > 0:
-          yield job_batch
-        job_batch = [job]
-        cur_progress_deadline = job_to_progress_deadline[job]
-      elif job_to_progress_deadline[job] > cur_progress_deadline - timedelta(seconds=1):
-        job_batch.append(job)
-      else:
-        sys.exit("jobs are not provided in order")
-    if len(job_batch) > 0:
-      yield job_batch
-    yield []
-
-  def UpdateJobDemand(self, ev_jobs, last_schedule_time, current_time):
-    if last_schedule_time not in self.peak_history:
+    while queue:
+      (progress_deadline, idx) = queue[0]
+      if end_time[idx] > start and demand[idx] > 1e-4:
+        if len(job_batch) > 0 and progress_deadline > batch_progress_deadline + timedelta(seconds=1):
+          break
+        if len(job_batch) == 0:
+          batch_progress_deadline = progress_deadline
+        job_batch.append(idx)
+      heapq.heappop(queue)
+    return job_batch
+
+  # Returns the job PopJobBatch would return first without popping it.
+  def PeekJob(self, queue, start, end_time, demand):
+    while queue:
+      (progress_deadline, idx) = queue[0]
+      if end_time[idx] > start and demand[idx] > 1e-4:
+        return idx
+      heapq.heappop(queue)
+    return None
+
+  # Simulates charging from last_schedule_time to current_time at the rate
+  # chosen at last_schedule_time, which is shared out by earliest progress
+  # deadline, and takes the energy delivered off the jobs' demand. The time is
+  # cut into segments at arrivals, completions and whenever two batches of
+  # jobs reach the same progress deadline. Jobs waiting to arrive are kept in a
+  # heap by start time and plugged-in jobs in a heap by progress deadline, so
+  # a segment only touches the jobs it charges. Jobs are referred to by their
+  # position in handles, which also breaks ties.
+  def UpdateJobDemand(self, handles, last_schedule_time, current_time):
+    if self.schedule_history.size == 0:
       return
-    old_ev_jobs = [job for job in ev_jobs if job.start_time < current_time]
-    total = self.peak_history[last_schedule_time]
+    total = float(self.schedule_history.LastTotalRate())
+    start_time = self.jobs.start[handles].tolist()
+    end_time = self.jobs.end[handles].tolist()
+    demand = self.jobs.demand[handles].tolist()
+    max_charging_rate = self.jobs.max_rate[handles].tolist()
     job_to_progress_deadline = {}
-    for job in old_ev_jobs:
-      job_to_progress_deadline[job] = job.end_time - timedelta(hours = job.demand_kwh / job.max_charging_rate)
+    arrivals = []
+    for idx in range(len(handles)):
+      if start_time[idx] < current_time:
+        job_to_progress_deadline[idx] = end_time[idx] - timedelta(hours = demand[idx] / max_charging_rate[idx])
+        arrivals.append((start_time[idx], idx))
+    heapq.heapify(arrivals)
+    queue = []
     start = last_schedule_time
+    num_segments = 0
     while True:
+      num_segments += 1
+      while arrivals and arrivals[0][0] <= start:
+        idx = heapq.heappop(arrivals)[1]
+        heapq.heappush(queue, (job_to_progress_deadline[idx], idx))
+      duration = min(arrivals[0][0], current_time) - start if arrivals else current_time - start
       total_rate = total
-      schedule = {}
+      schedule = []
       last_progress_deadline = datetime.min
-      last = last_schedule_time
-      arrived_jobs = [job for job in old_ev_jobs if job.start_time <= start and job.end_time > start]
-      arrived_jobs.sort(key=lambda job: job_to_progress_deadline[job])
-      duration = min([job.start_time for job in old_ev_jobs if job.start_time > start] + [current_time]) - start
-      generator = self.GetJobBatch(arrived_jobs, job_to_progress_deadline)
-      while True:
-	job_batch = next(generator)
-	if len(job_batch) == 0:
-	  break
+      # At a rate of 0, as after a tick with no jobs left, nothing charges
+      # until the next arrival.
+      while total_rate > 0.0:
+        job_batch = self.PopJobBatch(queue, start, end_time, demand)
+        if len(job_batch) == 0:
+          break
         total_max_charging_rate = 0.0
-        for job in job_batch:
-          total_max_charging_rate += job.max_charging_rate
+        for idx in job_batch:
+          total_max_charging_rate += max_charging_rate[idx]
         if total_max_charging_rate <= total_rate:
-	  fraction = 1.0
+          fraction = 1.0
         else:
           fraction = total_rate / total_max_charging_rate
-	  current_progress_deadline = job_to_progress_deadline[job_batch[0]]
-	  if last_progress_deadline > datetime.min and fraction < 1 - 1e-4:
-	    duration = min(duration, timedelta(seconds=(current_progress_deadline - last_progress_deadline).total_seconds() / (1 - fraction)))
+          current_progress_deadline = job_to_progress_deadline[job_batch[0]]
+          if last_progress_deadline > datetime.min and fraction < 1 - 1e-4:
+            duration = min(duration, timedelta(seconds=(current_progress_deadline - last_progress_deadline).total_seconds() / (1 - fraction)))
         last_progress_deadline = job_to_progress_deadline[job_batch[0]]
-	for job in job_batch:
-          schedule[job] = fraction
-	  duration = min(duration, timedelta(hours=job.demand_kwh / schedule[job]))
-	total_rate -= total_max_charging_rate
+        for idx in job_batch:
+          schedule.append((idx, fraction))
+          duration = min(duration, timedelta(hours=demand[idx] / fraction))
+        total_rate -= total_max_charging_rate
         if total_rate <= 1e-4:
-	  next_job_batch = next(generator)
-	  if len(next_job_batch) > 0 and fraction > 0:
-	    duration = min(duration, timedelta(seconds=(job_to_progress_deadline[next_job_batch[0]] - last_progress_deadline).total_seconds() / fraction))
-	  break
-      # Update job_to_progress_deadline
-      # print("total: ", duration.total_seconds())
+          next_idx = self.PeekJob(queue, start, end_time, demand)
+          if next_idx is not None and fraction > 0:
+            duration = min(duration, timedelta(seconds=(job_to_progress_deadline[next_idx] - last_progress_deadline).total_seconds() / fraction))
+          break
       end = min(start + duration, current_time)
       duration = end - start
-      for job in schedule:
-        job_to_progress_deadline[job] += timedelta(seconds=(duration.total_seconds() * schedule[job]))
-	job.demand_kwh -= job.max_charging_rate * schedule[job] * duration.total_seconds() / 3600.0
-	# print(duration, schedule[job], job)
+      for (idx, fraction) in schedule:
+        job_to_progress_deadline[idx] += timedelta(seconds=(duration.total_seconds() * fraction))
+        demand[idx] -= max_charging_rate[idx] * fraction * duration.total_seconds() / 3600.0
+        heapq.heappush(queue, (job_to_progress_deadline[idx], idx))
       start = end
       if start == current_time:
-	break
-
-  def GetTotalRate(self):
-    (peak_charging_rate, dummy) = ComputeOptimalPeak(self.all_jobs)
-    return peak_charging_rate * self.scale_factor
+        break
+    self.jobs.demand[handles] = demand
+    instrument.Count('segments', num_segments)
+
+  # Returns the optimal peak of the jobs with the given handles, with the
+  # start and demand they were added with if original.
+  def ComputePeak(self, handles, original=False):
+    start = time.time()
+    if self.incremental_lp and original and len(handles):
+      # The slots start at the earliest arrival, as for a fresh solve, so the
+      # model starts over whenever a job arrives before all the others.
+      origin = self.jobs.arrival[handles].min().tolist()
+      if self.incremental_peak_lp is None or self.incremental_peak_lp.origin != origin:
+        self.incremental_peak_lp = peak_lp.IncrementalPeakLp(origin, self.slot_length_sec)
+      (origin, start_sec, end_sec, demand_kwh, max_charging_rate) = self.jobs.Arrays(handles, True, self.incremental_peak_lp.origin)
+      self.incremental_peak_lp.Update(self.jobs.seq[handles].tolist(), start_sec, end_sec, demand_kwh, max_charging_rate)
+      peak = self.incremental_peak_lp.Solve()
+    elif len(handles) == 0:
+      peak = 0.0
+    else:
+      (peak, dummy) = ComputeOptimalPeakOfArrays(self.jobs.Arrays(handles, original), self.lp_solver, self.slot_length_sec, self.event_grid,
+                                                 self.peak_cache)
+    self.num_peak_solves += 1
+    self.peak_time_sec += time.time() - start
+    return peak
+
+  def GetTotalRate(self, schedule_time):
+    return self.ComputePeak(self.jobs.Active()) * self.scale_factor
 
   def Schedule(self, schedule_time):
     assert schedule_time >= self.last_schedule_time
-    self.schedule_history[schedule_time] = {}
-    num_jobs = len(self.all_jobs)
-    self.UpdateJobDemand(self.all_jobs, self.last_schedule_time, schedule_time)
-    # print(self.all_jobs)
-    for idx in range(num_jobs - 1, -1, -1):
-      job_id = self.all_jobs[idx].id
-      self.all_jobs[idx].start_time = schedule_time    
-      if self.all_jobs[idx].end_time <= schedule_time and self.all_jobs[idx].demand_kwh > 1e-4:
-	# print("Unfinished job: ", self.all_jobs[idx].id)
-	self.num_unfinished_job += 1
-      if self.all_jobs[idx].demand_kwh <= 1e-4 or self.all_jobs[idx].end_time <= schedule_time:
-        self.all_jobs.pop(idx)
-
-    peak_charging_rate = self.GetTotalRate()
-    job_to_progress_deadline = {}
-    total_max_charging_rate = 0.0
-    for job in self.all_jobs:
-      assert job.end_time > schedule_time
-      total_max_charging_rate += job.max_charging_rate
-    self.peak_history[schedule_time] = min(total_max_charging_rate, peak_charging_rate)
+    jobs = self.jobs
+    handles = jobs.Active()
+    with instrument.Span('UpdateJobDemand'):
+      self.UpdateJobDemand(handles, self.last_schedule_time, schedule_time)
+    now = np.datetime64(schedule_time, 'us')
+    jobs.start[handles] = now
+    ended = jobs.end[handles] <= now
+    unfinished = jobs.demand[handles] > 1e-4
+    self.num_unfinished_job += int(np.count_nonzero(ended & unfinished))
+    self.RetireJobs(handles[ended | ~unfinished])
+    handles = handles[~ended & unfinished]
+
+    peak_charging_rate = self.GetTotalRate(schedule_time)
+    total_max_charging_rate = sum(jobs.max_rate[handles].tolist(), 0.0)
+    self.schedule_history.Record(schedule_time, min(total_max_charging_rate, peak_charging_rate))
     self.last_schedule_time = schedule_time
 
   def Name(self):
     return "Greedy scheduler"
 
-  def TotalChargingRate(self, schedule_time):
-    return self.peak_history[schedule_time]
-
 class EpsScheduler(GreedyScheduler):
 
-  def __init__(self, scale_factor=1.0):
-    GreedyScheduler.__init__(self, scale_factor)
+  # With rolling_horizon the peak of the jobs as added is kept in a
+  # peak_lp.RollingPeakLp rather than solved over every job ever added, so
+  # that a run need not be cut into days. incremental_lp, event_grid and
+  # peak_cache are then ignored, and lp_solver 'flow' falls back to GLOP.
+  def __init__(self, scale_factor=1.0, lp_solver='glop', incremental_lp=False, slot_length_sec=900.0, event_grid=False, peak_cache=None,
+               rolling_horizon=False):
+    GreedyScheduler.__init__(self, scale_factor, lp_solver, incremental_lp, slot_length_sec, event_grid, peak_cache)
+    self.rolling_horizon = rolling_horizon
+    self.rolling_peak_lp = None
 
-  def GetTotalRate(self):
-    (peak_charging_rate, dummy) = ComputeOptimalPeak(self.original_jobs)
-    return peak_charging_rate * self.scale_factor
+  def AddEvJob(self, job_id, notify_time, arrival_time, end_time, demand, max_charging_rate):
+    GreedyScheduler.AddEvJob(self, job_id, notify_time, arrival_time, end_time, demand, max_charging_rate)
+    if self.rolling_horizon:
+      if self.rolling_peak_lp is None:
+        solver = self.lp_solver if self.lp_solver in peak_lp.SOLVERS else 'glop'
+        self.rolling_peak_lp = peak_lp.RollingPeakLp(notify_time, self.slot_length_sec, solver)
+      origin = self.rolling_peak_lp.origin
+      self.rolling_peak_lp.Add((arrival_time - origin).total_seconds(), (end_time - origin).total_seconds(), demand, max_charging_rate)
+
+  def GetTotalRate(self, schedule_time):
+    if self.rolling_horizon:
+      return self.RollingPeak(schedule_time) * self.scale_factor
+    return self.ComputePeak(self.jobs.Live(), original=True) * self.scale_factor
+
+  def RollingPeak(self, schedule_time):
+    if self.rolling_peak_lp is None:
+      return 0.0
+    start = time.time()
+    self.rolling_peak_lp.Advance((schedule_time - self.rolling_peak_lp.origin).total_seconds())
+    peak = self.rolling_peak_lp.Solve()
+    self.num_peak_solves += 1
+    self.peak_time_sec += time.time() - start
+    return peak
+
+  # The jobs as added are only needed when all of them are solved for.
+  def RetireJobs(self, handles):
+    if self.rolling_horizon:
+      self.jobs.Free(handles)
+    else:
+      self.jobs.Deactivate(handles)
 
   def Name(self):
     return "Eps scheduler"
@@ -0,0 +1,219 @@
+from __future__ import print_function
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import json
+import math
+import sys
+import time
+
+import ev
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_enum('service_scheduler', 'greedy', ['greedy', 'eps'], 'online scheduler to serve')
+flags.DEFINE_string('host', '127.0.0.1', 'address to listen on')
+flags.DEFINE_integer('port', 8765, 'TCP port to listen on')
+flags.DEFINE_string('socket', '', 'Unix socket to listen on instead of --host and --port')
+flags.DEFINE_float('tick_window_ms', 50.0, 'how long to gather events after the first one before scheduling them together')
+flags.DEFINE_float('latency_budget_ms', 1000.0, 'decision latency above which a reply is flagged over_budget')
+
+# Serves an online scheduler to live session events, over newline-delimited
+# JSON on a TCP or Unix socket. Python 3 only.
+#
+# A request is one JSON object per line:
+#
+#   {"seq": 7, "event": "reserve", "id": "s1", "time": 1523930000.0,
+#    "start": 1523940800.0, "end": 1523962400.0, "energy_kwh": 10.5,
+#    "max_rate_kw": 6.6}
+#
+# with times in seconds since the epoch. "reserve" announces a session ahead
+# of its start; "plugin" announces a session that was not reserved, and is
+# only acknowledged for one that was; "unplug" is acknowledged, as the
+# schedulers already know when every session leaves. "tick" only asks for the
+# current setpoint. Every request gets one reply line with the same seq, the
+# time the events were scheduled up to, the total rate setpoint in kW, and how
+# long the decision took:
+#
+#   {"seq": 7, "time": 1523930000.0, "total_rate_kw": 12.3, "solve_ms": 8.1,
+#    "server_ms": 58.9, "over_budget": false}
+#
+# or {"seq": 7, "error": "..."}. Events that arrive within --tick_window_ms of
+# the first pending one are added together and scheduled with one Schedule()
+# call at the latest of their times. That call runs on an executor thread, so
+# that connections keep being read meanwhile; the events that arrive in the
+# meantime make up the next tick. Events older than the scheduler's current
+# time are taken as announced late, at that time. --scale, --lp_solver,
+# --incremental_lp, --lp_slot_sec, --event_grid and --rolling_horizon are as
+# for ev.py.
+
+_EVENTS = ['reserve', 'plugin', 'unplug', 'tick']
+# Latest time a request may name, 3000-01-01, far enough from datetime.max
+# for the scheduler's arithmetic on it.
+_MAX_TIME = 32503680000
+
+
+def _MakeScheduler(config):
+  if FLAGS.service_scheduler == 'greedy':
+    return schedule.GreedyScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid)
+  return schedule.EpsScheduler(config.scale, config.lp_solver, config.incremental_lp, config.lp_slot_sec, config.event_grid,
+                               rolling_horizon=config.rolling_horizon)
+
+# Returns why request is not a valid event, or None.
+def _Invalid(request):
+  if not isinstance(request, dict):
+    return 'request is not an object'
+  if request.get('event') not in _EVENTS:
+    return 'event must be one of ' + ', '.join(_EVENTS)
+  required = ['time'] if request['event'] == 'tick' else ['id', 'time']
+  if request['event'] in ['reserve', 'plugin']:
+    required += ['start', 'end', 'energy_kwh', 'max_rate_kw']
+  for name in required:
+    if name not in request:
+      return 'missing ' + name
+    if name == 'id':
+      if not isinstance(request[name], str):
+        return 'id must be a string'
+    elif not isinstance(request[name], (int, float)) or isinstance(request[name], bool) or not math.isfinite(request[name]):
+      return name + ' must be a finite number'
+    elif name in ['time', 'start', 'end'] and not 0 <= request[name] <= _MAX_TIME:
+      return name + ' must be between 0 and %d seconds since the epoch' % _MAX_TIME
+  if request['event'] in ['reserve', 'plugin'] and not (request['end'] > request['start'] and request['max_rate_kw'] > 0):
+    return 'end must be after start and max_rate_kw positive'
+  return None
+
+
+class SchedulingService(object):
+
+  def __init__(self, scheduler, tick_window_sec, latency_budget_sec):
+    self.scheduler = scheduler
+    self.tick_window_sec = tick_window_sec
+    self.latency_budget_sec = latency_budget_sec
+    # The only thread that touches the scheduler.
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self.pending = []
+    self.wakeup = asyncio.Event()
+    # Sessions announced and not yet unplugged, so that the plug-in of a
+    # reserved session is not added twice.
+    self.announced = set()
+    self.stats = collections.Counter()
+
+  # Queues request and returns its reply.
+  async def Submit(self, request):
+    future = asyncio.get_event_loop().create_future()
+    self.pending.append((request, future, time.time()))
+    self.wakeup.set()
+    return await future
+
+  # Adds the events of a tick and schedules them. Runs on the executor. All
+  # requests are converted before the scheduler is touched, so that one that
+  # cannot be leaves it as it was.
+  def _Tick(self, requests):
+    start = time.time()
+    scheduler = self.scheduler
+    events = []
+    for request in sorted(requests, key=lambda request : request['time']):
+      notify_time = max(datetime.datetime.fromtimestamp(request['time']), scheduler.current_time)
+      if request['event'] in ['reserve', 'plugin']:
+        events.append((request['event'], request['id'], notify_time, max(datetime.datetime.fromtimestamp(request['start']), notify_time),
+                       datetime.datetime.fromtimestamp(request['end']), float(request['energy_kwh']), float(request['max_rate_kw'])))
+      else:
+        events.append((request['event'], request.get('id'), notify_time))
+    schedule_time = scheduler.last_schedule_time
+    for event in events:
+      (kind, session_id, notify_time) = event[:3]
+      schedule_time = max(schedule_time, notify_time)
+      if kind == 'unplug':
+        self.announced.discard(session_id)
+      elif kind in ['reserve', 'plugin'] and session_id not in self.announced:
+        self.announced.add(session_id)
+        scheduler.AddEvJob(session_id, *event[2:])
+    if schedule_time > scheduler.last_schedule_time:
+      scheduler.Schedule(schedule_time)
+    history = scheduler.schedule_history
+    total_rate = float(history.LastTotalRate()) if history.size else 0.0
+    return schedule_time, total_rate, time.time() - start
+
+  # Gathers the events of every tick window and answers them.
+  async def Run(self):
+    loop = asyncio.get_event_loop()
+    while True:
+      await self.wakeup.wait()
+      await asyncio.sleep(self.tick_window_sec)
+      self.wakeup.clear()
+      (batch, self.pending) = (self.pending, [])
+      try:
+        (schedule_time, total_rate, solve_sec) = await loop.run_in_executor(
+            self.executor, self._Tick, [request for (request, future, received) in batch])
+      except Exception as e:
+        for (request, future, received) in batch:
+          future.set_result({'seq': request.get('seq'), 'error': 'schedule failed: %r' % e})
+        self.stats['failed_ticks'] += 1
+        continue
+      self.stats['ticks'] += 1
+      self.stats['events'] += len(batch)
+      now = time.time()
+      for (request, future, received) in batch:
+        over_budget = now - received > self.latency_budget_sec
+        self.stats['over_budget'] += int(over_budget)
+        future.set_result({'seq': request.get('seq'), 'time': ev.ToEpochSeconds(schedule_time), 'total_rate_kw': total_rate,
+                           'solve_ms': solve_sec * 1000.0, 'server_ms': (now - received) * 1000.0, 'over_budget': over_budget})
+
+  async def HandleConnection(self, reader, writer):
+    replies = set()
+    while True:
+      line = await reader.readline()
+      if not line:
+        break
+      try:
+        request = json.loads(line.decode('utf-8'))
+        error = _Invalid(request)
+      except ValueError as e:
+        (request, error) = (None, 'bad JSON: %s' % e)
+      if error:
+        seq = request.get('seq') if isinstance(request, dict) else None
+        writer.write((json.dumps({'seq': seq, 'error': error}) + '\n').encode('utf-8'))
+        continue
+      reply = asyncio.ensure_future(self._Reply(request, writer))
+      replies.add(reply)
+      reply.add_done_callback(replies.discard)
+    if replies:
+      await asyncio.wait(replies)
+    writer.close()
+
+  async def _Reply(self, request, writer):
+    reply = await self.Submit(request)
+    writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+    await writer.drain()
+
+
+async def _Serve(service):
+  if FLAGS.socket:
+    server = await asyncio.start_unix_server(service.HandleConnection, path=FLAGS.socket)
+  else:
+    server = await asyncio.start_server(service.HandleConnection, FLAGS.host, FLAGS.port)
+  print('serving %s on %s' % (service.scheduler.Name(), FLAGS.socket or '%s:%d' % (FLAGS.host, FLAGS.port)), file=sys.stderr)
+  runner = asyncio.ensure_future(service.Run())
+  try:
+    await server.serve_forever()
+  finally:
+    runner.cancel()
+    print('ticks: %d events: %d over budget: %d' % (service.stats['ticks'], service.stats['events'], service.stats['over_budget']),
+          file=sys.stderr)
+
+def main(argv):
+  service = SchedulingService(_MakeScheduler(ev.SimConfigFromFlags()), FLAGS.tick_window_ms / 1000.0, FLAGS.latency_budget_ms / 1000.0)
+  try:
+    asyncio.run(_Serve(service))
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,134 @@
+from __future__ import print_function
+
+import datetime
+import itertools
+import sys
+import time
+
+import acn_data
+import ev
+import instrument
+import numpy as np
+import result_store
+import results
+import schedule
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('scales', ['1.0', '1.05', '1.1', '1.15', '1.2', '1.25', '1.3'], 'scaling factors to sweep')
+flags.DEFINE_list('probs', ['0.5'], 'reserve probabilities to sweep')
+flags.DEFINE_list('reserve_leads', ['3'], 'reservation lead times to sweep in hours')
+flags.DEFINE_list('schedule_slots', ['15'], 'minimum times between ticks of the online schedulers to sweep in minutes')
+flags.DEFINE_string('output', 'sweep.csv', 'file to write the result table to, as .npz for a path ending in it, else as CSV')
+flags.DEFINE_string('store', '', 'directory to keep every result in as it is computed, see result_store, so that a sweep only computes '
+                    'the results the directory lacks')
+flags.DEFINE_string('code_version', '', 'version to key stored results by, such as a commit, instead of the hash of the simulation code')
+
+# Runs the online schedulers of ev.RunDay over every combination of the swept
+# settings and every day of the Caltech ACN period, and writes one row per
+# (setting, day, scheduler) to --output, see results.COLUMNS.
+#
+# The sessions are loaded once. The offline optimum of a day depends on
+# neither the swept settings nor the reservations, so it is solved once per
+# day and shared by all settings. --lp_solver, --incremental_lp, --lp_slot_sec,
+# --event_grid, --trace and --workers are as for ev.py. So are
+# --peak_cache_entries and --peak_cache_dir; the peaks EpsScheduler solves for
+# do not depend on the scale, so with a cache directory they are only solved
+# for the first one.
+#
+# With --store every result is kept in that directory as soon as its cell
+# finishes, by the worker that computed it. A sweep then skips the (setting,
+# day) cells whose results are all stored, so that one that died resumes
+# where it stopped and one that adds a setting to a grid only computes that
+# setting. The table in --output always covers the whole grid.
+
+def _RunCell(cell):
+  (data, config, day, setting, optimal_peak, store_dir, code_version) = cell
+  (summaries, peak_solves, cache_stats, metrics) = ev.RunDay(data, config, oracle=False)
+  rows = results.Rows(day, setting, summaries, optimal_peak)
+  if store_dir:
+    store = result_store.ResultStore(store_dir, code_version)
+    for (summary, row) in zip(summaries, rows):
+      store.Put(store.Key(summary.name, setting, day, config), row)
+  return rows, metrics
+
+def _RunOracle(cell):
+  (data, config) = cell
+  if config.instrument:
+    instrument.Enable()
+  return ev.RunOracle(data, config), instrument.Collect()
+
+def main(argv):
+  time_period = [datetime.datetime(2018, 4, 16, 21, 0, 0), datetime.datetime(2018, 9, 16, 21, 0, 0)]
+  delta = datetime.timedelta(hours=24)
+  start = time.time()
+  columns = acn_data.LoadColumns(ev.DATA_FILE)
+  probs = [float(prob) for prob in FLAGS.probs]
+  sessions = {}
+  for prob in probs:
+    sessions[prob] = ev.SelectSessions(columns, time_period[0], time_period[1], prob)
+  # The batches only depend on the start times, so every prob has the same.
+  rows = sessions[probs[0]][0]
+  days = [(i, begin, end) for i, (begin, end) in enumerate(ev.BatchSlices(columns, rows, time_period[0], delta)) if end > begin]
+  labels = [(time_period[0] + i * delta).strftime('%Y-%m-%d') for (i, begin, end) in days]
+  base = ev.SimConfigFromFlags()
+  if base.instrument:
+    instrument.Enable()
+  trace = instrument.Trace()
+  store = result_store.ResultStore(FLAGS.store or None, FLAGS.code_version or None)
+
+  def Records(prob, reserve_lead_hours, day_index):
+    (rows, reserved) = sessions[prob]
+    (i, begin, end) = days[day_index]
+    return ev.MakeRecords(columns, rows[begin:end], reserved[begin:end], datetime.timedelta(hours=reserve_lead_hours))
+
+  # The oracle rows are stored without a setting and given each setting's
+  # when the table is written.
+  optimal_name = schedule.OracleScheduler().Name()
+  optimal_keys = [store.Key(optimal_name, None, day, base) for day in labels]
+  missing = [j for j, key in enumerate(optimal_keys) if store.Get(key) is None]
+  for j, (optimal_summary, metrics) in zip(missing, ev.OrderedMap(_RunOracle, ((Records(probs[0], 0.0, j), base) for j in missing),
+                                                                  FLAGS.workers)):
+    store.Put(optimal_keys[j], results.Rows(labels[j], (np.nan,) * 4, [optimal_summary], optimal_summary.peak)[0])
+    trace.Add(metrics, labels[j])
+  optimal_peaks = [store.Get(key)[results.COLUMNS.index('peak')] for key in optimal_keys]
+
+  settings = list(itertools.product([float(scale) for scale in FLAGS.scales], probs, [float(lead) for lead in FLAGS.reserve_leads],
+                                    [float(slot) for slot in FLAGS.schedule_slots]))
+  names = [scheduler.Name() for schedulers in ev.MakeSchedulers(base, None, oracle=False) for scheduler in schedulers]
+
+  def Config(setting):
+    return base._replace(scale=setting[0], schedule_slot_min=setting[3])
+
+  def Keys(setting, j):
+    return [store.Key(name, setting, labels[j], Config(setting)) for name in names]
+
+  pending = [(setting, j) for setting in settings for j in range(len(days))
+             if any(store.Get(key) is None for key in Keys(setting, j))]
+  cells = ((Records(setting[1], setting[2], j), Config(setting), labels[j], setting, optimal_peaks[j], FLAGS.store, store.code_version)
+           for (setting, j) in pending)
+  for (setting, j), (cell_rows, metrics) in zip(pending, ev.OrderedMap(_RunCell, cells, FLAGS.workers)):
+    for (key, row) in zip(Keys(setting, j), cell_rows):
+      store.Put(key, row)
+    trace.Add(metrics, labels[j])
+
+  rows = []
+  for setting in settings:
+    for j in range(len(days)):
+      optimal_row = store.Get(optimal_keys[j])
+      rows.extend([store.Get(key) for key in Keys(setting, j)] + [(labels[j],) + setting + optimal_row[len(setting) + 1:]])
+  results.Write(FLAGS.output, rows)
+  if FLAGS.trace:
+    trace.Add(instrument.Collect())
+    trace.Write(FLAGS.trace)
+    for line in trace.SummaryLines():
+      print(line, file=sys.stderr)
+  print('settings: %d days: %d cells computed: %d of %d seconds: %.1f' % (len(settings), len(days), len(pending), len(settings) * len(days),
+                                                                            time.time() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,51 @@
+import collections
+import datetime
+
+import ev
+import numpy as np
+
+# Seeded synthetic charging sessions, as ev.EvRecord like ev.LoadData returns.
+#
+# Sessions arrive as a Poisson process of arrivals_per_hour and stay for a
+# log-normal dwell of mean mean_dwell_hours. Each charges at a rate cap drawn
+# uniformly from [min_rate_kw, max_rate_kw] and wants a gamma (shape 2)
+# energy of mean mean_energy_kwh, cut to what the cap delivers in 95% of the
+# dwell; done_charging is when the cap would have delivered it, so that
+# ev.RunDay derives the same cap back. A fraction reserve_prob of the sessions
+# are announced reserve_lead_hours before they start, the rest at their start.
+# The defaults are close to the Caltech ACN sessions.
+
+WorkloadConfig = collections.namedtuple('WorkloadConfig', ['arrivals_per_hour', 'mean_dwell_hours', 'dwell_sigma', 'mean_energy_kwh',
+                                                           'min_rate_kw', 'max_rate_kw', 'reserve_prob', 'reserve_lead_hours'])
+
+DEFAULT_WORKLOAD = WorkloadConfig(arrivals_per_hour=3.0, mean_dwell_hours=6.0, dwell_sigma=0.6, mean_energy_kwh=10.0, min_rate_kw=1.5,
+                                  max_rate_kw=6.6, reserve_prob=0.5, reserve_lead_hours=3.0)
+
+
+# Returns the sessions of workload starting in [start_time, end_time), by
+# start time. The same seed gives the same sessions.
+def GenerateRecords(workload, start_time, end_time, seed=0):
+  rng = np.random.RandomState(seed)
+  hours = ev.ToHours(end_time - start_time)
+  # Draw more gaps than the expected count so one batch almost always covers
+  # the period.
+  starts = np.zeros(0)
+  while len(starts) == 0 or starts[-1] < hours:
+    gaps = rng.exponential(1.0 / workload.arrivals_per_hour, int(workload.arrivals_per_hour * hours * 1.2) + 16)
+    starts = np.concatenate([starts, (starts[-1] if len(starts) else 0.0) + np.cumsum(gaps)])
+  starts = starts[starts < hours]
+  n = len(starts)
+  mu = np.log(workload.mean_dwell_hours) - workload.dwell_sigma ** 2 / 2
+  dwells = rng.lognormal(mu, workload.dwell_sigma, n)
+  rates = rng.uniform(workload.min_rate_kw, workload.max_rate_kw, n)
+  energies = np.minimum(rng.gamma(2.0, workload.mean_energy_kwh / 2.0, n), 0.95 * rates * dwells)
+  reserved = rng.random_sample(n) < workload.reserve_prob
+  reserve_lead = datetime.timedelta(hours=workload.reserve_lead_hours)
+  records = []
+  for (i, start, dwell, rate, energy, is_reserved) in zip(range(n), starts.tolist(), dwells.tolist(), rates.tolist(), energies.tolist(),
+                                                          reserved.tolist()):
+    record_start_time = start_time + datetime.timedelta(hours=start)
+    records.append(ev.EvRecord('synthetic-%d' % i, record_start_time - reserve_lead if is_reserved else record_start_time, record_start_time,
+                               record_start_time + datetime.timedelta(hours=dwell), energy,
+                               record_start_time + datetime.timedelta(hours=energy / rate), 'synthetic'))
+  return records